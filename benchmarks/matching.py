@@ -0,0 +1,150 @@
+"""Benchmarks the highlight match engines without Discord or Postgres.
+
+Usage: python -m benchmarks.matching [--sizes 10 1000 100000] [--save results.json] [--compare baseline.json]
+"""
+
+import argparse
+import json
+import platform
+import random
+import statistics
+import sys
+import time
+
+from cogs.utils import matching
+
+ALPHABETS = [
+    "abcdefghijklmnopqrstuvwxyz",
+    "abcdefghijklmnopqrstuvwxyzéèêàçñöüß",
+    "абвгдеёжзийклмнопрстуфхцчшщыэюя",
+    "αβγδεζηθικλμνξοπρστυφχψω"
+]
+FILLER = ["the", "a", "to", "and", "is", "it", "you", "that", "was", "for", "on", "are", "with", "lol", "ok"]
+PUNCTUATION = [".", ",", "!", "?", "...", ":", ";", "'s", "s", ""]
+EMOJI = ["\N{GRINNING FACE}", "\N{THUMBS UP SIGN}", "\N{FIRE}", "\N{PARTY POPPER}", "<:custom:123456789012345678>"]
+LENGTHS = {"short": (10, 80), "medium": (200, 500), "long": (1500, 2000)}
+
+def make_word(rng):
+    alphabet = rng.choice(ALPHABETS)
+    word = "".join(rng.choice(alphabet) for _ in range(rng.randint(3, 12)))
+
+    # Some words are more than one token
+    if rng.random() < 0.05:
+        word += rng.choice([" ", "-", "+"]) + "".join(rng.choice(alphabet) for _ in range(rng.randint(2, 6)))
+
+    return word
+
+def make_words(rng, size):
+    words = set()
+    while len(words) < size:
+        words.add(make_word(rng))
+
+    return sorted(words)
+
+def make_message(rng, words, length, hit_rate):
+    low, high = LENGTHS[length]
+    target = rng.randint(low, high)
+    parts = []
+
+    while sum(map(len, parts)) < target:
+        roll = rng.random()
+        if roll < hit_rate:
+            word = rng.choice(words)
+            parts.append(rng.choice([word, word.upper(), word.capitalize()]) + rng.choice(PUNCTUATION))
+        elif roll < 0.1:
+            parts.append(rng.choice(EMOJI))
+        elif roll < 0.3:
+            parts.append(make_word(rng))
+        else:
+            parts.append(rng.choice(FILLER) + rng.choice(PUNCTUATION))
+
+        if rng.random() < 0.02:
+            parts.append("\n")
+
+    return " ".join(parts)[:2000]
+
+def percentile(samples, percent):
+    samples = sorted(samples)
+    index = min(len(samples)-1, int(len(samples)*percent/100))
+    return samples[index]
+
+def run(engine, words, messages):
+    start = time.perf_counter()
+    matcher = matching.ENGINES[engine](words)
+    build = time.perf_counter()-start
+
+    # Warm up, so the first few messages don't include lazy compilation
+    for message in messages[:5]:
+        matcher.find(message)
+
+    latencies = []
+    matched = 0
+    for message in messages:
+        start = time.perf_counter_ns()
+        matched += len(matcher.find(message))
+        latencies.append(time.perf_counter_ns()-start)
+
+    total = sum(latencies)/1e9
+    characters = sum(map(len, messages))
+
+    return {
+        "build_ms": round(build*1000, 3),
+        "messages_per_second": round(len(messages)/total, 1),
+        "characters_per_second": round(characters/total, 1),
+        "p50_us": round(percentile(latencies, 50)/1000, 2),
+        "p99_us": round(percentile(latencies, 99)/1000, 2),
+        "mean_us": round(statistics.fmean(latencies)/1000, 2),
+        "matched": matched
+    }
+
+def compare(results, baseline):
+    print("\nCompared to baseline (positive is faster):")
+    for key, result in results.items():
+        old = baseline.get(key)
+        if not old:
+            continue
+
+        throughput = (result["messages_per_second"]/old["messages_per_second"]-1)*100
+        p99 = (old["p99_us"]/result["p99_us"]-1)*100
+        note = "" if result["matched"] == old["matched"] else f" (matched {old['matched']} -> {result['matched']})"
+        print(f"  {key:<32} throughput {throughput:+7.1f}%  p99 {p99:+7.1f}%{note}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the highlight match engines")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 1000, 100000], help="guild word counts to benchmark")
+    parser.add_argument("--engines", nargs="+", default=list(matching.ENGINES), choices=list(matching.ENGINES))
+    parser.add_argument("--lengths", nargs="+", default=list(LENGTHS), choices=list(LENGTHS))
+    parser.add_argument("--messages", type=int, default=300, help="messages per corpus")
+    parser.add_argument("--hit-rate", type=float, default=0.02, help="chance of each part of a message being a highlight word")
+    parser.add_argument("--regex-limit", type=int, default=10000, help="skip the regex engine above this many words")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--save", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="compare the results to a JSON file from an earlier run")
+    args = parser.parse_args()
+
+    results = {}
+    for size in args.sizes:
+        rng = random.Random(args.seed+size)
+        words = make_words(rng, size)
+
+        for length in args.lengths:
+            messages = [make_message(rng, words, length, args.hit_rate) for _ in range(args.messages)]
+
+            for engine in args.engines:
+                if engine == "regex" and size > args.regex_limit:
+                    continue
+
+                key = f"{engine}/{size}/{length}"
+                results[key] = result = run(engine, words, messages)
+                print(f"{key:<32} {result['messages_per_second']:>10.1f} msg/s  p50 {result['p50_us']:>10.2f}us  p99 {result['p99_us']:>10.2f}us  build {result['build_ms']:>9.1f}ms  matched {result['matched']}")
+
+    if args.compare:
+        with open(args.compare) as file:
+            compare(results, json.load(file)["results"])
+
+    if args.save:
+        with open(args.save, "w") as file:
+            json.dump({"python": platform.python_version(), "args": vars(args), "results": results}, file, indent=2)
+
+if __name__ == "__main__":
+    sys.exit(main())
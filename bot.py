@@ -7,6 +7,8 @@ import asyncpg
 import discord
 from discord.ext import commands
 
+from cogs.utils.words import WordIndex
+
 log = logging.getLogger("highlight")
 logging.basicConfig(
     level=logging.INFO,
@@ -67,7 +69,10 @@ class HighlightBot(commands.Bot):
                    FROM words;
                 """
         cached_words = await self.db.fetch(query)
-        self.cached_words = [dict(cached_word) for cached_word in cached_words]
+
+        self.cached_words = WordIndex()
+        for cached_word in cached_words:
+            self.cached_words.add(cached_word["guild_id"], cached_word["user_id"], cached_word["word"])
 
     async def on_ready(self):
         log.info(f"Logged in as {self.user.name} - {self.user.id}")
@@ -98,5 +103,7 @@ class HighlightBot(commands.Bot):
     def config(self):
         return __import__("config")
 
-bot = HighlightBot()
-bot.run()
+# The guard keeps the match pool's worker processes from starting the bot again
+if __name__ == "__main__":
+    bot = HighlightBot()
+    bot.run()
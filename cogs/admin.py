@@ -16,7 +16,7 @@ import time
 import traceback
 from jishaku import codeblocks, paginators, shell
 
-from .utils import formats, menus
+from .utils import formats, matching, menus
 
 log = logging.getLogger("highlight.admin")
 
@@ -158,6 +158,92 @@ class Admin(commands.Cog):
         except discord.HTTPException:
             await ctx.send(file=discord.File(io.BytesIO(str(results).encode("utf-8")), filename="result.txt"))
 
+    @commands.group(name="shadow", description="View how a candidate match engine compares to the current one", invoke_without_command=True)
+    async def shadow(self, ctx):
+        highlight = self.bot.get_cog("Highlight")
+        shadow = highlight.shadow
+        engine = getattr(self.bot.config, "match_engine", "auto")
+
+        if not shadow.engine:
+            return await ctx.send("Shadow mode is not running")
+
+        em = discord.Embed(title="Shadow Mode", description=f"`{shadow.engine}` against `{engine}` on {shadow.rate:.2%} of messages", color=discord.Color.blurple())
+        em.add_field(name="Sampled", value=shadow.sampled)
+        em.add_field(name="Disagreements", value=f"{shadow.disagreements} ({shadow.disagreements/shadow.sampled if shadow.sampled else 0:.2%})")
+        em.add_field(name="Average Time", value=f"{shadow.primary_average:.1f}us `{engine}`\n{shadow.candidate_average:.1f}us `{shadow.engine}`")
+
+        recent = []
+        for disagreement in reversed(shadow.recent):
+            missing = ", ".join(f"`{word}` (<@{user_id}>)" for user_id, word in disagreement.missing)
+            extra = ", ".join(f"`{word}` (<@{user_id}>)" for user_id, word in disagreement.extra)
+            recent.append(f"[Jump]({disagreement.jump_url}) {f'missing {missing}' if missing else ''} {f'extra {extra}' if extra else ''}")
+
+        if recent:
+            em.add_field(name="Recent Disagreements", value="\n".join(recent)[:1024], inline=False)
+
+        await ctx.send(embed=em)
+
+    @shadow.command(name="start", description="Start comparing a candidate match engine")
+    async def shadow_start(self, ctx, engine, rate: float = 0.01):
+        if engine not in matching.ENGINES:
+            return await ctx.send(f"Unknown engine. Choose from {formats.join([f'`{engine}`' for engine in matching.ENGINES])}")
+
+        shadow = self.bot.get_cog("Highlight").shadow
+        shadow.engine = engine
+        shadow.rate = max(0, min(rate, 1))
+        shadow.reset()
+
+        await ctx.send(f":white_check_mark: Comparing `{engine}` on {shadow.rate:.2%} of messages")
+
+    @shadow.command(name="stop", description="Stop comparing the candidate match engine")
+    async def shadow_stop(self, ctx):
+        shadow = self.bot.get_cog("Highlight").shadow
+        shadow.engine = None
+
+        await ctx.send(":octagonal_sign: Stopped shadow mode")
+
+    @commands.command(name="caches", description="View the hit rates of the highlight caches")
+    async def caches(self, ctx):
+        highlight = self.bot.get_cog("Highlight")
+
+        table = formats.Tabulate()
+        table.add_columns(["Cache", "Size", "Hits", "Misses", "Hit Rate"])
+        for name, cache in highlight.caches.items():
+            table.add_row([name, f"{len(cache)}/{cache.maxsize}", cache.hits, cache.misses, f"{cache.hit_rate:.2%}"])
+
+        await ctx.send(f"```{table}```")
+
+    @commands.command(name="pipeline", description="View how many highlights each check has rejected")
+    async def pipeline(self, ctx):
+        highlight = self.bot.get_cog("Highlight")
+
+        table = formats.Tabulate()
+        table.add_columns(["Stage", "Rejected"])
+        table.add_rows([[name, rejected] for name, rejected in highlight.rejections.items()])
+
+        await ctx.send(f"```{table}```")
+
+    @commands.command(name="delivery", description="View the highlight DM queue")
+    async def delivery(self, ctx):
+        highlight = self.bot.get_cog("Highlight")
+        delivery = highlight.delivery
+
+        def percentile(latencies, percent):
+            if not latencies:
+                return "N/A"
+            latencies = sorted(latencies)
+            return f"{latencies[min(len(latencies)-1, int(len(latencies)*percent))]*1000:.0f}ms"
+
+        em = discord.Embed(title="Delivery", color=discord.Color.blurple())
+        em.add_field(name="Queued", value=f"{formats.plural(delivery.depth):highlight} for {formats.plural(delivery.users):user}")
+        em.add_field(name="Senders", value=delivery.senders)
+        em.add_field(name="Sent", value=f"{delivery.sent} ({delivery.failed} failed)")
+        em.add_field(name="Unreachable", value=f"{formats.plural(len(highlight.unreachable)):user}")
+        em.add_field(name="Send Latency", value=f"p50 {percentile(delivery.send_latencies, 0.5)}, p99 {percentile(delivery.send_latencies, 0.99)}")
+        em.add_field(name="Delivery Latency", value=f"p50 {percentile(delivery.delivery_latencies, 0.5)}, p99 {percentile(delivery.delivery_latencies, 0.99)}")
+
+        await ctx.send(embed=em)
+
     @commands.command(name="process", description="View system stats", aliases=["system", "health"])
     async def process(self, ctx):
         em = discord.Embed(title="Process", color=discord.Color.blurple())
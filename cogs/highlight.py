@@ -1,7 +1,11 @@
 import asyncio
+import concurrent.futures
 import datetime
+import hashlib
+import json
 import logging
-import re
+import multiprocessing
+import tempfile
 import typing
 
 import asyncpg
@@ -10,15 +14,10 @@ import discord
 from discord import app_commands
 from discord.ext import commands, menus, tasks
 
-from .utils import formats, human_time, menus
+from .utils import cache, db, delivery, export, formats, human_time, matching, menus, patterns, render, scheduler, shadow
 
 log = logging.getLogger("cogs.highlight")
 
-class JumpBackView(discord.ui.View):
-    def __init__(self, jump_url):
-        super().__init__()
-        self.add_item(discord.ui.Button(url=jump_url, label="Go to Message"))
-
 class ServerSelect(discord.ui.Select):
     def __init__(self, guilds):
         options = [discord.SelectOption(label=guild.name, value=guild.id) for guild in guilds]
@@ -73,7 +72,7 @@ class TransferWordsView(discord.ui.View):
             await interaction.response.send_message(content="You have no words to transfer from that server.", ephemeral=True)
 
         for transfered in to_transfer:
-            self.bot.cached_words.append(transfered)
+            self.bot.cached_words.add(transfered["guild_id"], transfered["user_id"], transfered["word"])
 
     @discord.ui.button(label="Cancel", style=discord.ButtonStyle.danger)
     async def cancel(self, interaction, button):
@@ -88,33 +87,319 @@ class TransferWordsView(discord.ui.View):
         self.disable_buttons()
         await self.message.edit(view=self)
 
+class HighlightContext:
+    """The parts of a message that every recipient's checks share, computed once."""
+
+    def __init__(self, bot, message):
+        self.bot = bot
+        self.message = message
+        self.author_id = message.author.id
+        self.channel_id = message.channel.id
+        self.category_id = message.channel.category.id if message.channel.category else None
+        self.mention_ids = {user.id for user in message.mentions}
+
+        self.render = None
+
+        self._is_command = None
+
+    async def is_command(self):
+        if self._is_command is None:
+            self._is_command = (await self.bot.get_context(self.message)).valid
+
+        return self._is_command
+
+class Recipient:
+    """Someone who might be highlighted by a message."""
+
+    def __init__(self, user_id, word, span):
+        self.user_id = user_id
+        self.word = word
+        self.span = span
+        self.member = None
+        self.settings = None
+
+class HistoryFlags(commands.FlagConverter):
+    word: typing.Optional[str] = commands.flag(default=None, description="Only show highlights for this word")
+    channel: typing.Optional[discord.abc.GuildChannel] = commands.flag(default=None, description="Only show highlights from this channel")
+    server: bool = commands.flag(default=False, description="Only show highlights from this server")
+
 class Highlight(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
-        self._highlight_batch = []
-        self._batch_lock = asyncio.Lock()
+        # Highlights are recorded in batches, spilling to a local file while the database is down
+        self._highlight_batch = db.HighlightBatch(self.insert_highlights, size=getattr(self.bot.config, "highlight_batch_size", 500), spill_path=getattr(self.bot.config, "highlight_spill_file", "highlights.spill"))
 
         self.blocked._fallback_command.wrapped.cog = self # Temporary fix for discord.py bug
 
-        self.bulk_insert_loop.add_exception_type(asyncpg.PostgresConnectionError)
+        # Matching for very large guilds and long messages can be moved off the event loop
+        workers = getattr(self.bot.config, "match_workers", 0)
+        if workers:
+            self._match_pool = concurrent.futures.ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        else:
+            self._match_pool = None
+
+        # Compares a candidate match engine against the configured one on live messages
+        self.shadow = shadow.Shadow(getattr(self.bot.config, "shadow_engine", None), getattr(self.bot.config, "shadow_rate", 0.01))
+
+        # Spam and copy-pasted messages are matched once per version of the guild's words
+        self._match_cache = cache.LRUCache(getattr(self.bot.config, "match_cache_size", 4096))
+
+        # Settings are read for every highlight candidate, so they're kept in memory
+        self._settings_cache = cache.LRUCache(getattr(self.bot.config, "settings_cache_size", 10000))
+        self._settings_evictions = 0 # bumped whenever a change from another process evicts settings
+
+        # Whether a member can see a channel, so checking it doesn't go through every member of the guild
+        self._visibility_cache = cache.LRUCache(getattr(self.bot.config, "visibility_cache_channels", 5000))
+
+        # The last few messages of each active channel, for the history in highlight messages
+        self._recent_messages = cache.RecentMessages(getattr(self.bot.config, "recent_messages", 10), getattr(self.bot.config, "recent_message_channels", 2000))
+
+        # Highlight counts for stats, which don't need to be exact to the second
+        self._stats_cache = cache.TTLCache(1000, getattr(self.bot.config, "stats_cache_ttl", 300))
+
+        self.caches = {"Match results": self._match_cache, "User settings": self._settings_cache, "Channel visibility": self._visibility_cache, "Recent messages": self._recent_messages.channels, "Stats": self._stats_cache}
+
+        # Seconds of CPU time each guild's patterns get per message
+        self.pattern_budget = getattr(self.bot.config, "pattern_budget", patterns.BUDGET)
+
+        # Each message's recipients go through these in order, so the cheapest checks
+        # weed people out before the expensive ones run
+        self.pipeline = [
+            ("author", self.skip_author),
+            ("mentioned", self.skip_mentioned),
+            ("unreachable", self.skip_unreachable),
+            ("cooldown", self.skip_cooldown),
+            ("member", self.skip_unknown_members),
+            ("command", self.skip_commands),
+            ("disabled", self.skip_disabled),
+            ("blocked", self.skip_blocked),
+            ("visibility", self.skip_hidden)
+        ]
+        self.rejections = {name: 0 for name, stage in self.pipeline}
+
+        # When each (user ID, channel ID) can be highlighted again
+        self.cooldowns = cache.Cooldowns()
+
+        # Highlights wait here for a bit, in case the user sees the message on their own
+        self.scheduler = scheduler.ActivityScheduler(self.release_highlight, getattr(self.bot.config, "activity_timeout", 10))
+        self.scheduler.start()
+
+        # With "queue", highlights are handed to worker.py through the highlight_jobs table
+        # instead of being rendered and sent here
+        self.delivery_mode = getattr(self.bot.config, "delivery_mode", "direct")
+
+        # DMs go out through a fixed number of senders, and highlights for the same user are merged
+        self.delivery = delivery.DeliveryQueue(self.send_highlights, senders=getattr(self.bot.config, "dm_senders", 4), window=getattr(self.bot.config, "dm_coalesce_window", 2))
+        self.delivery.start()
+
+        # Users we couldn't DM are backed off, and disabled after too many failures
+        self.unreachable = delivery.Unreachable(getattr(self.bot.config, "dm_backoff", 60), getattr(self.bot.config, "dm_backoff_max", 86400))
+
         self.bulk_insert_loop.start()
 
+        # Changes from other processes (or the sql command) come in through LISTEN/NOTIFY
+        self.cache_versions = {} # guild ID (or 0 for settings) -> last change applied
+        self._changes = asyncio.Queue()
+        self._listener = None
+        self._listener_task = asyncio.create_task(self.listen_for_changes())
+        self._changes_task = asyncio.create_task(self.apply_changes())
+
+    def make_settings(self, user_id, disabled=False, blocked_users=None, blocked_channels=None, cooldown=None):
+        # Blocked lists are frozensets, so cached settings can't be changed by accident
+        return {"user_id": user_id, "disabled": bool(disabled), "blocked_users": frozenset(blocked_users or ()), "blocked_channels": frozenset(blocked_channels or ()), "cooldown": cooldown}
+
+    async def get_users_settings(self, user_ids):
+        settings = {}
+        missing = []
+
+        for user_id in user_ids:
+            cached = self._settings_cache.get(user_id)
+            if cached:
+                settings[user_id] = cached
+            else:
+                missing.append(user_id)
+
+        if missing:
+            query = """SELECT *
+                       FROM settings
+                       WHERE settings.user_id=ANY($1::bigint[]);
+                    """
+            evictions = self._settings_evictions
+            rows = {row["user_id"]: row for row in await self.bot.db.fetch(query, missing)}
+
+            # If something was evicted while we waited, these rows could be from before the change
+            stale = evictions != self._settings_evictions
+
+            for user_id in missing:
+                row = rows.get(user_id)
+                settings[user_id] = self.make_settings(user_id, row["disabled"], row["blocked_users"], row["blocked_channels"], row["cooldown"]) if row else self.make_settings(user_id)
+                if not stale:
+                    self._settings_cache[user_id] = settings[user_id]
+
+        return settings
+
     async def get_user_settings(self, user_id):
-        query = """SELECT *
-                   FROM settings
-                   WHERE settings.user_id=$1;
+        settings = await self.get_users_settings([user_id])
+        return settings[user_id]
+
+    async def update_user_settings(self, user_id, **changes):
+        settings = await self.get_user_settings(user_id)
+        settings = self.make_settings(**{**settings, **changes})
+
+        query = """INSERT INTO settings (user_id, disabled, blocked_users, blocked_channels, cooldown)
+                   VALUES ($1, $2, $3, $4, $5)
+                   ON CONFLICT (user_id)
+                   DO UPDATE SET disabled=$2, blocked_users=$3, blocked_channels=$4, cooldown=$5;
                 """
-        settings = await self.bot.db.fetchrow(query, user_id)
+        await self.bot.db.execute(query, user_id, settings["disabled"], list(settings["blocked_users"]), list(settings["blocked_channels"]), settings["cooldown"])
 
-        if settings:
-            return dict(settings)
-        elif not settings:
-            return {"user_id": user_id, "disabled": False, "blocked_users": [], "blocked_channels": []}
+        # Written through, so the cache never has to be invalidated for our own changes
+        self._settings_cache[user_id] = settings
+        return settings
 
     async def cog_unload(self):
+        self.scheduler.stop()
+        self.delivery.stop()
+
+        self._listener_task.cancel()
+        self._changes_task.cancel()
+        if self._listener:
+            await self._listener.close()
+
         log.info("Stopping bulk insert loop")
         self.bulk_insert_loop.stop()
-        await self.bulk_insert()
+        await self._highlight_batch.flush()
+
+        if self._match_pool:
+            log.info("Shutting down match pool")
+            self._match_pool.shutdown(wait=False, cancel_futures=True)
+
+    async def listen_for_changes(self):
+        await self.bot.wait_until_ready()
+        retry = 1
+
+        while True:
+            closed = asyncio.Event()
+
+            try:
+                self._listener = await asyncpg.connect(self.bot.config.database_uri)
+                self._listener.add_termination_listener(lambda connection: closed.set())
+                await self._listener.add_listener("highlight_words", self.on_change)
+                await self._listener.add_listener("highlight_settings", self.on_change)
+
+                # Anything could have changed while we weren't listening
+                self._changes.put_nowait(("resync", None))
+                retry = 1
+
+                log.info("Listening for cache changes")
+                await closed.wait()
+                log.warning("Lost the cache change listener connection")
+            except (OSError, asyncio.TimeoutError, asyncpg.PostgresError, asyncpg.InterfaceError):
+                log.exception("Couldn't connect the cache change listener, retrying in %s seconds", retry)
+
+            await asyncio.sleep(retry)
+            retry = min(retry*2, 60)
+
+    def on_change(self, connection, pid, channel, payload):
+        # Handled in order by apply_changes, so nothing is applied in the middle of a resync
+        self._changes.put_nowait((channel, json.loads(payload)))
+
+    async def apply_changes(self):
+        while True:
+            channel, change = await self._changes.get()
+
+            try:
+                if channel == "resync":
+                    await self.resync_all()
+                    continue
+
+                scope = change["guild_id"] if channel == "highlight_words" else 0
+                last = self.cache_versions.get(scope, 0)
+
+                if change["version"] <= last:
+                    continue
+                elif change["version"] > last+1:
+                    log.warning("Missed cache changes for scope %s (at %s, got %s), resyncing", scope, last, change["version"])
+                    await self.resync_scope(scope)
+                    continue
+
+                self.cache_versions[scope] = change["version"]
+
+                if channel == "highlight_settings":
+                    self._settings_cache.pop(change["user_id"])
+                    self._settings_evictions += 1
+                elif change["op"] == "add":
+                    self.bot.cached_words.add(change["guild_id"], change["user_id"], change["word"])
+                else:
+                    self.bot.cached_words.remove(change["guild_id"], change["user_id"], change["word"])
+            except Exception:
+                log.exception("Couldn't apply a cache change, resyncing everything")
+                self._changes.put_nowait(("resync", None))
+                await asyncio.sleep(5)
+
+    async def resync_scope(self, scope):
+        async with self.bot.db.acquire() as connection:
+            async with connection.transaction(readonly=True, isolation="repeatable_read"):
+                version = await connection.fetchval("SELECT cache_versions.version FROM cache_versions WHERE cache_versions.scope=$1;", scope)
+
+                if scope:
+                    words = await connection.fetch("SELECT words.user_id, words.word FROM words WHERE words.guild_id=$1;", scope)
+
+        if scope:
+            self.bot.cached_words.replace(scope, [(row["user_id"], row["word"]) for row in words])
+        else:
+            self._settings_cache.clear()
+            self._settings_evictions += 1
+
+        self.cache_versions[scope] = version or 0
+
+    async def resync_all(self):
+        async with self.bot.db.acquire() as connection:
+            async with connection.transaction(readonly=True, isolation="repeatable_read"):
+                versions = await connection.fetch("SELECT * FROM cache_versions;")
+                words = await connection.fetch("SELECT * FROM words;")
+
+        guilds = {guild_id: [] for guild_id in self.bot.cached_words.guilds}
+        for row in words:
+            guilds.setdefault(row["guild_id"], []).append((row["user_id"], row["word"]))
+
+        changed = sum(self.bot.cached_words.replace(guild_id, pairs) for guild_id, pairs in guilds.items())
+        self._settings_cache.clear()
+        self._settings_evictions += 1
+        self.cache_versions = {row["scope"]: row["version"] for row in versions}
+
+        log.info("Resynced cached words (%s guilds changed)", changed)
+
+    def engine_for(self, guild_words):
+        engine = getattr(self.bot.config, "match_engine", "auto")
+        if engine != "auto":
+            return engine
+
+        # The compiled regex is faster until a guild has enough words for the automaton to pay off
+        return "automaton" if len(guild_words) >= getattr(self.bot.config, "automaton_words", 100) else "regex"
+
+    def should_offload(self, guild_words, content):
+        return len(guild_words) >= getattr(self.bot.config, "offload_words", 1000) or len(content) >= getattr(self.bot.config, "offload_length", 1500)
+
+    async def find_in_pool(self, guild_words, content, engine):
+        loop = asyncio.get_running_loop()
+
+        # Take the version and the words together, since they can change while we wait
+        version = guild_words.version
+        words = guild_words.snapshot()
+
+        try:
+            matches = await loop.run_in_executor(self._match_pool, matching.find_in_worker, guild_words.guild_id, version, engine, content, self.pattern_budget)
+
+            # The worker that picked this up hasn't seen this version of the guild's words yet
+            if matches is None:
+                matches = await loop.run_in_executor(self._match_pool, matching.find_in_worker, guild_words.guild_id, version, engine, content, self.pattern_budget, words)
+
+            return matches
+        except concurrent.futures.process.BrokenProcessPool:
+            log.exception("Match pool is broken, falling back to matching inline")
+            self._match_pool = None
+            return guild_words.find(content, engine, self.pattern_budget)
 
     @commands.Cog.listener("on_message")
     async def check_highlights(self, message):
@@ -123,133 +408,311 @@ class Highlight(commands.Cog):
         elif message.author.bot:
             return
 
-        notified_users = []
-        possible_words = [word for word in self.bot.cached_words if word["guild_id"] == message.guild.id]
+        guild_words = self.bot.cached_words.get(message.guild.id)
+        if not guild_words:
+            return
+
+        engine = self.engine_for(guild_words)
 
-        # Go through all possible messages
-        for possible_word in possible_words:
-            # Use regex to check if the highlight word is in the message
-            # And avoid any false positives
-            escaped = re.escape(possible_word["word"])
-            match = re.match(r"^(?:.+ )?(?:\W*)({word})(?:[{word}]*)(?:\W+|[(?:'|\")s]*)(?: .+)?$".format(word=escaped), message.content, re.I)
+        # The version changes whenever the guild's words do, so stale results are never used
+        key = (message.guild.id, guild_words.version, hashlib.blake2b(message.content.encode(), digest_size=16).digest())
+        matches = self._match_cache.get(key)
 
-            # If there's a match and the user wasn't already notified
-            if match and possible_word["user_id"] not in notified_users:
-                notified_users.append(possible_word["user_id"])
-                self.bot.dispatch(f"highlight", message, possible_word, match.group(1))
+        # Find every highlight word of this guild in the message
+        if matches is None:
+            if self._match_pool and self.should_offload(guild_words, message.content):
+                matches = await self.find_in_pool(guild_words, message.content, engine)
+            elif self.shadow.sample():
+                matches = self.shadow.compare(guild_words, message, engine)
+            else:
+                matches = guild_words.find(message.content, engine, self.pattern_budget)
 
-    # The following three listeners send a user activity to the on_highlight_trigger function
+            self._match_cache[key] = matches
+
+        notified_users = set()
+        recipients = []
+
+        for user_id, word, span in matches:
+            # Skip anyone who was already notified, or removed the word while the message was matched
+            if user_id in notified_users or user_id not in guild_words.words.get(word, ()):
+                continue
+
+            notified_users.add(user_id)
+            recipients.append(Recipient(user_id, word, span))
+
+        if recipients:
+            self.bot.dispatch("highlight", message, recipients)
+
+    # The following three listeners record user activity for the scheduler
     # This way the user has time to indicate that they saw the message and we do not need to highlight them
     @commands.Cog.listener()
     async def on_message(self, message):
-        self.bot.dispatch("user_activity", message.channel, message.author)
+        self.scheduler.touch(message.channel.id, message.author.id)
+
+        if message.guild:
+            self._recent_messages.add(message.channel.id, cache.RecentMessage.from_message(message))
 
     @commands.Cog.listener()
     async def on_typing(self, channel, user, when):
-        self.bot.dispatch("user_activity", channel, user)
+        self.scheduler.touch(channel.id, user.id)
 
     @commands.Cog.listener()
     async def on_reaction_add(self, reaction, user):
-        self.bot.dispatch("user_activity", reaction.message.channel, user)
+        self.scheduler.touch(reaction.message.channel.id, user.id)
+
+    @commands.Cog.listener()
+    async def on_ready(self):
+        # Messages could have been missed while we were disconnected
+        self._recent_messages.channels.clear()
+
+    # Raw events, so the recent messages stay right even for messages that aren't in discord.py's cache
+    @commands.Cog.listener()
+    async def on_raw_message_edit(self, payload):
+        if "content" in payload.data:
+            self._recent_messages.edit(payload.channel_id, payload.message_id, payload.data["content"])
+
+    @commands.Cog.listener()
+    async def on_raw_message_delete(self, payload):
+        self._recent_messages.delete(payload.channel_id, {payload.message_id})
 
     @commands.Cog.listener()
-    async def on_highlight(self, message, word, text):
-        member = message.guild.get_member(word["user_id"])
+    async def on_raw_bulk_message_delete(self, payload):
+        self._recent_messages.delete(payload.channel_id, payload.message_ids)
 
-        if not member:
-            log.info("Unknown user ID %s (guild ID %s)", word["user_id"], word["guild_id"])
+    @commands.Cog.listener()
+    async def on_highlight(self, message, recipients):
+        context = HighlightContext(self.bot, message)
+
+        for name, stage in self.pipeline:
+            kept = await stage(context, recipients)
+            self.rejections[name] += len(recipients)-len(kept)
+            recipients = kept
+
+            if not recipients:
+                return
+
+        if self.delivery_mode == "queue":
+            context.render = None
+        else:
+            history = await self.get_history(context.message)
+            context.render = render.HighlightRender(message, history)
+
+        for recipient in recipients:
+            # Only the word and its span are specific to this recipient
+            em = context.render.embed(recipient.word, recipient.span) if context.render else None
+            self.scheduler.schedule(message.channel.id, recipient.user_id, (message, recipient, em))
+
+    def get_cooldown(self, settings):
+        cooldown = settings["cooldown"]
+        return cooldown if cooldown is not None else getattr(self.bot.config, "highlight_cooldown", 0)
+
+    async def get_history(self, message, limit=3):
+        history = self._recent_messages.before(message.channel.id, message.id, limit)
+        if history is not None:
+            return history
+
+        # Only fetch the history when we haven't seen enough of the channel yet
+        try:
+            history = [cache.RecentMessage.from_message(ms) async for ms in message.channel.history(limit=limit, before=message)]
+        except discord.HTTPException:
+            return []
 
+        self._recent_messages.seed(message.channel.id, history)
+        return history
+
+    async def skip_author(self, context, recipients):
+        # Don't highlight the user themself
+        return [recipient for recipient in recipients if recipient.user_id != context.author_id]
+
+    async def skip_mentioned(self, context, recipients):
         # Don't highlight if they were already pinged
-        if member in message.mentions:
-            return
-        # Don't highlight if they can't even see the channel
-        elif member not in message.channel.members:
-            return
+        return [recipient for recipient in recipients if recipient.user_id not in context.mention_ids]
+
+    async def skip_unreachable(self, context, recipients):
+        # Don't try to DM users with closed DMs until their backoff is up
+        return [recipient for recipient in recipients if not self.unreachable.skipped(recipient.user_id)]
+
+    async def skip_cooldown(self, context, recipients):
+        # Don't highlight again in a channel they were just highlighted in
+        return [recipient for recipient in recipients if not self.cooldowns.active((recipient.user_id, context.channel_id))]
+
+    async def skip_unknown_members(self, context, recipients):
+        kept = []
+        for recipient in recipients:
+            recipient.member = context.message.guild.get_member(recipient.user_id)
+
+            if recipient.member:
+                kept.append(recipient)
+            else:
+                log.info("Unknown user ID %s (guild ID %s)", recipient.user_id, context.message.guild.id)
+
+        return kept
+
+    async def skip_commands(self, context, recipients):
         # Don't highlight if it's a command
-        elif (await self.bot.get_context(message)).valid:
-            return
+        return [] if await context.is_command() else recipients
 
-        settings = await self.get_user_settings(member.id)
+    async def skip_disabled(self, context, recipients):
+        settings = await self.get_users_settings([recipient.user_id for recipient in recipients])
 
-        # Don't highlight if the user themsel
-        if member.id == message.author.id:
-            return
-        elif settings["disabled"]:
-            return
-        # Don't highlight if they blocked the trigger author or channel
-        elif message.channel.id in settings["blocked_channels"] or message.author.id in settings["blocked_users"]:
-            return
-        # Don't highlight if they blocked the entire category
-        elif message.channel.category and message.channel.category.id in settings["blocked_channels"]:
-            return
+        for recipient in recipients:
+            recipient.settings = settings[recipient.user_id]
+
+        return [recipient for recipient in recipients if not recipient.settings["disabled"]]
 
-        # Prepare highlight message
-        initial_description = f"In {message.channel.mention} for `{discord.utils.escape_markdown(message.guild.name)}` you were highlighted with the word **{discord.utils.escape_markdown(word['word'])}**\n\n"
+    async def skip_blocked(self, context, recipients):
+        kept = []
+        for recipient in recipients:
+            settings = recipient.settings
 
-        em = discord.Embed(description="", timestamp=message.created_at, color=discord.Color.blurple())
-        em.set_author(name=message.author.display_name, icon_url=message.author.display_avatar.url)
-        em.set_footer(text="Triggered")
+            # Don't highlight if they blocked the trigger author or channel
+            if context.channel_id in settings["blocked_channels"] or context.author_id in settings["blocked_users"]:
+                continue
+            # Don't highlight if they blocked the entire category
+            elif context.category_id and context.category_id in settings["blocked_channels"]:
+                continue
 
-        # Add trigger message
-        span = re.search(re.escape(word["word"]), message.content.lower()).span()
+            kept.append(recipient)
 
-        if len(message.content) > 2000:
-            if span[1] > 2000:
-                end = min(200, span[0]-1)
-                content = f"{discord.utils.escape_markdown(message.content[:end])}... **{discord.utils.escape_mentions(messae.content)}** ..."
+        return kept
+
+    async def skip_hidden(self, context, recipients):
+        # Don't highlight if they can't even see the channel
+        return [recipient for recipient in recipients if self.can_see(context.message.channel, recipient.member)]
+
+    def can_see(self, channel, member):
+        # Private threads also need the member to have joined, which permissions don't cover
+        if isinstance(channel, discord.Thread):
+            if channel.type == discord.ChannelType.private_thread and member.id not in {thread_member.id for thread_member in channel.members}:
+                return False
+            return channel.permissions_for(member).read_messages
+
+        members = self._visibility_cache.get(channel.id)
+        if members is None:
+            members = self._visibility_cache[channel.id] = {}
+
+        visible = members.get(member.id)
+        if visible is None:
+            visible = members[member.id] = channel.permissions_for(member).read_messages
+
+        return visible
+
+    def invalidate_visibility(self, guild, member_id=None):
+        for channel in guild.channels:
+            members = self._visibility_cache.peek(channel.id)
+            if members is None:
+                continue
+            elif member_id:
+                members.pop(member_id, None)
             else:
-                content = discord.utils.escape_markdown(message.content[:2000])
-        else:
-            content = discord.utils.escape_markdown(message.content[:span[0]])
-            content += f"**{discord.utils.escape_markdown(text)}**"
-            content += discord.utils.escape_markdown(message.content[span[1]:])
+                self._visibility_cache.pop(channel.id)
 
-        timestamp = message.created_at.timestamp()
-        em.description = f"<t:{int(timestamp)}:t> {discord.utils.escape_markdown(str(message.author))}: {content}"
+    @commands.Cog.listener()
+    async def on_guild_channel_update(self, before, after):
+        # Editing a category can change the permissions of the channels synced with it
+        self._visibility_cache.pop(after.id)
+        if isinstance(after, discord.CategoryChannel):
+            for channel in after.channels:
+                self._visibility_cache.pop(channel.id)
 
-        # Add some history
-        try:
-            messages = []
-            async for ms in message.channel.history(limit=3, before=message):
-                content = f"{ms.content[:50]}{'...' if len(ms.content) > 50 else ''}"
-                timestamp = ms.created_at.timestamp()
+    @commands.Cog.listener()
+    async def on_guild_channel_delete(self, channel):
+        self._visibility_cache.pop(channel.id)
 
-                text = f"<t:{int(timestamp)}:t> {discord.utils.escape_markdown(str(ms.author))}: {discord.utils.escape_markdown(content)}\n"
+    @commands.Cog.listener()
+    async def on_guild_role_update(self, before, after):
+        if before.permissions != after.permissions:
+            self.invalidate_visibility(after.guild)
 
-                if len(initial_description + em.description + text) <= 4096:
-                    em.description = text + em.description
-        except discord.HTTPException:
-            pass
+    @commands.Cog.listener()
+    async def on_guild_role_delete(self, role):
+        self.invalidate_visibility(role.guild)
 
-        em.description = initial_description + em.description
+    @commands.Cog.listener()
+    async def on_guild_update(self, before, after):
+        if before.owner_id != after.owner_id:
+            self.invalidate_visibility(after)
 
-        # Wait for any activity
-        try:
-            await self.bot.wait_for("user_activity", check=lambda channel, user: message.channel == channel and user == member, timeout=10)
+    @commands.Cog.listener()
+    async def on_member_update(self, before, after):
+        if before.roles != after.roles or before.timed_out_until != after.timed_out_until:
+            self.invalidate_visibility(after.guild, after.id)
+
+    @commands.Cog.listener()
+    async def on_member_remove(self, member):
+        self.invalidate_visibility(member.guild, member.id)
+
+    def release_highlight(self, item):
+        message, recipient, em = item
+
+        # The cooldown only starts once a highlight actually goes out, so one cancelled by the
+        # user being active doesn't hold back the next. Others released from the same grace
+        # period are dropped here.
+        key = (recipient.user_id, message.channel.id)
+        if self.cooldowns.active(key):
+            self.rejections["cooldown"] += 1
             return
-        except asyncio.TimeoutError:
-            pass
+        self.cooldowns.start(key, self.get_cooldown(recipient.settings))
+
+        if self.delivery_mode == "queue":
+            asyncio.create_task(self.enqueue_highlight(message, recipient))
+        else:
+            self.delivery.put(recipient.user_id, item)
 
-        # Send the highlight message
+    async def enqueue_highlight(self, message, recipient):
+        query = """INSERT INTO highlight_jobs (guild_id, guild_name, channel_id, message_id, author_id, user_id, word, span_start, span_end)
+                   VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9);
+                """
         try:
-            await member.send(embed=em, view=JumpBackView(message.jump_url))
-            log.info("Sent highlight DM to user ID %s (guild ID %s)", member.id, message.guild.id)
-
-            self._highlight_batch.append(
-                {
-                    "guild_id": message.guild.id,
-                    "channel_id": message.channel.id,
-                    "message_id": message.id,
-                    "author_id": message.author.id,
-                    "user_id": word["user_id"],
-                    "word": word["word"],
-                    "invoked_at": message.created_at.isoformat()
-                }
-            )
-        except discord.Forbidden:
-            log.warning("Forbidden to DM user ID %s (guild ID %s)", member.id, message.guild.id)
+            await self.bot.db.execute(query, message.guild.id, message.guild.name, message.channel.id, message.id, message.author.id, recipient.user_id, recipient.word, *recipient.span)
+        except (OSError, asyncpg.PostgresError):
+            log.exception("Couldn't queue highlight for user ID %s (message ID %s)", recipient.user_id, message.id)
+
+    async def send_highlights(self, user_id, items):
+        member = items[0][1].member
 
-    @commands.hybrid_command(name="add", description="Add a word to your highlight word list")
+        # Long highlights can't all fit in one message, so they're split up by length as well
+        for group in render.split_embeds(items, lambda item: item[2]):
+            guild_ids = {message.guild.id for message, recipient, em in group}
+
+            # Send the highlight message
+            try:
+                await member.send(embeds=[em for message, recipient, em in group], view=render.JumpBackView(*[message.jump_url for message, recipient, em in group]))
+                log.info("Sent %s highlights to user ID %s (guild IDs %s)", len(group), member.id, guild_ids)
+            except discord.Forbidden:
+                failures = self.unreachable.fail(user_id)
+                log.warning("Forbidden to DM user ID %s (guild IDs %s, %s failures)", member.id, guild_ids, failures)
+
+                if failures >= getattr(self.bot.config, "dm_failures_disable", 5):
+                    log.info("Disabling highlight for unreachable user ID %s", user_id)
+                    await self.update_user_settings(user_id, disabled=True)
+                    self.unreachable.clear(user_id)
+                return
+            except discord.HTTPException:
+                log.exception("Couldn't send %s highlights to user ID %s (guild IDs %s)", len(group), member.id, guild_ids)
+                continue
+
+            self.unreachable.clear(user_id)
+
+            # Only recorded once it's actually been delivered
+            for message, recipient, em in group:
+                await self._highlight_batch.add(db.highlight_record(message, recipient.user_id, recipient.word))
+
+    def check_pattern(self, guild_id, word):
+        try:
+            pattern = patterns.Pattern(word)
+        except patterns.PatternError as exc:
+            return f"Your highlight pattern is invalid: {exc}."
+
+        # Every pattern in a guild is scanned together, so they share a limit
+        guild_words = self.bot.cached_words.get(guild_id)
+        matcher = guild_words.matcher(self.engine_for(guild_words)) if guild_words else None
+        states = len(matcher.patterns.kinds) if matcher and matcher.patterns else 0
+
+        if states + pattern.states > getattr(self.bot.config, "pattern_guild_states", 1000):
+            return "This server has too many highlight patterns. Try a simpler pattern or a regular word."
+
+    @commands.hybrid_command(name="add", description="Add a word to your highlight word list (wrap it in slashes for a pattern, like /colou?r/)")
     @commands.guild_only()
     async def add(self, ctx, *, word):
 
@@ -259,14 +722,17 @@ class Highlight(commands.Cog):
             if exc.code == 50007:
                 await ctx.send("You need to have DMs enabled for highlight notifications to work.", delete_after=5, ephemeral=True)
 
-        word = word.lower()
+        word = patterns.normalize(word)
+        is_pattern = patterns.is_pattern(word)
 
         if discord.utils.escape_mentions(word) != word:
             await ctx.send("Your highlight word cannot contain any mentions.", delete_after=5, ephemeral=True)
         elif len(word) < 2:
             await ctx.send("Your highlight word must contain at least 2 characters.", delete_after=5, ephemeral=True)
-        elif len(word) > 20:
+        elif len(word) > 20 and not is_pattern:
             await ctx.send("Your highlight word cannot contain more than 20 characters.", delete_after=5, ephemeral=True)
+        elif is_pattern and (error := self.check_pattern(ctx.guild.id, word)):
+            await ctx.send(error, delete_after=5, ephemeral=True)
         else:
             try:
                 query = """INSERT INTO words (user_id, guild_id, word)
@@ -274,7 +740,7 @@ class Highlight(commands.Cog):
                         """
                 await self.bot.db.execute(query, ctx.author.id, ctx.guild.id, word)
 
-                self.bot.cached_words.append({"user_id": ctx.author.id, "guild_id": ctx.guild.id, "word": word})
+                self.bot.cached_words.add(ctx.guild.id, ctx.author.id, word)
                 await ctx.send(f":white_check_mark: Added `{word}` to your highlight list.", delete_after=5, ephemeral=True)
             except asyncpg.UniqueViolationError:
                 await ctx.send("You cannot add the same highlight word multiple times.", delete_after=5, ephemeral=True)
@@ -282,7 +748,7 @@ class Highlight(commands.Cog):
     @commands.hybrid_command(name="remove", description="Remove a word from your highlight word list")
     @commands.guild_only()
     async def remove(self, ctx, *, word):
-        word = word.lower()
+        word = patterns.normalize(word)
 
         query = """DELETE FROM words
                    WHERE words.user_id=$1 AND words.guild_id=$2 AND words.word=$3;
@@ -295,14 +761,12 @@ class Highlight(commands.Cog):
             await ctx.send(f":white_check_mark: Removed `{word}` from your highlight list.", delete_after=5, ephemeral=True)
 
         # Remove word from the cache, so we don't trigger deleted highlights
-        for cached_word in self.bot.cached_words:
-            if cached_word["user_id"] == ctx.author.id and cached_word["guild_id"] == ctx.guild.id and cached_word["word"] == word:
-                self.bot.cached_words.remove(cached_word)
+        self.bot.cached_words.remove(ctx.guild.id, ctx.author.id, word)
 
     @commands.hybrid_command(name="show", description="See all your highlight words", aliases=["words", "list"])
     @commands.guild_only()
     async def show(self, ctx):
-        words = [cached_word for cached_word in self.bot.cached_words if cached_word["user_id"] == ctx.author.id and cached_word["guild_id"] == ctx.guild.id]
+        words = self.bot.cached_words.user_words(ctx.guild.id, ctx.author.id)
 
         if not words:
             await ctx.send("You have no highlight words in this server.", delete_after=10, ephemeral=True)
@@ -312,7 +776,7 @@ class Highlight(commands.Cog):
 
             em.description = ""
             for word in words:
-                em.description += f"\n{word['word']}"
+                em.description += f"\n{word}"
 
             await ctx.send(embed=em, delete_after=10, ephemeral=True)
 
@@ -329,9 +793,7 @@ class Highlight(commands.Cog):
 
         await ctx.send(f":white_check_mark: Your highlight list has been cleared in this server.", delete_after=5, ephemeral=True)
 
-        for cached_word in self.bot.cached_words:
-            if cached_word["user_id"] == ctx.author.id and cached_word["guild_id"] == ctx.guild.id:
-                self.bot.cached_words.remove(cached_word)
+        self.bot.cached_words.clear(ctx.guild.id, ctx.author.id)
 
     @commands.command(name="transfer", description="Import your highlight words from another server", usage="<server ID>", aliases=["import"])
     @commands.guild_only()
@@ -364,7 +826,7 @@ class Highlight(commands.Cog):
             await ctx.send("You have no words to transfer from this server.", delete_after=5)
 
         for transfered in to_transfer:
-            self.bot.cached_words.append(transfered)
+            self.bot.cached_words.add(transfered["guild_id"], transfered["user_id"], transfered["word"])
 
     @app_commands.command(name="transfer", description="Import your highlight words from another server")
     @commands.guild_only()
@@ -385,12 +847,7 @@ class Highlight(commands.Cog):
             if entity.id in settings["blocked_users"]:
                 return "This user is already blocked."
             else:
-                settings["blocked_users"].append(entity.id)
-                query = """UPDATE settings
-                            SET blocked_users=$1
-                            WHERE settings.user_id=$2;
-                        """
-                await self.bot.db.execute(query, settings["blocked_users"], user_id)
+                await self.update_user_settings(user_id, blocked_users=settings["blocked_users"] | {entity.id})
                 return f":no_entry_sign: Blocked `{entity}`."
 
         elif isinstance(entity, discord.TextChannel) or isinstance(entity, discord.CategoryChannel):
@@ -398,12 +855,7 @@ class Highlight(commands.Cog):
                 return "This channel is already blocked."
 
             else:
-                settings["blocked_channels"].append(entity.id)
-                query = """UPDATE settings
-                            SET blocked_channels=$1
-                            WHERE settings.user_id=$2;
-                        """
-                await self.bot.db.execute(query, settings["blocked_channels"], user_id)
+                await self.update_user_settings(user_id, blocked_channels=settings["blocked_channels"] | {entity.id})
                 return f":no_entry_sign: Blocked {entity.mention}."
 
     async def do_unblock(self, user_id, entity):
@@ -413,24 +865,14 @@ class Highlight(commands.Cog):
             if entity.id not in settings["blocked_users"]:
                 return "This user is not blocked."
             else:
-                settings["blocked_users"].remove(entity.id)
-                query = """UPDATE settings
-                            SET blocked_users=$1
-                            WHERE settings.user_id=$2;
-                        """
-                await self.bot.db.execute(query, settings["blocked_users"], user_id)
+                await self.update_user_settings(user_id, blocked_users=settings["blocked_users"] - {entity.id})
                 return f":white_check_mark: Unblocked `{entity}`."
 
         elif isinstance(entity, discord.TextChannel) or isinstance(entity, discord.CategoryChannel):
             if entity.id not in settings["blocked_channels"]:
                 return "This channel is not blocked."
             else:
-                settings["blocked_channels"].remove(entity.id)
-                query = """UPDATE settings
-                            SET blocked_channels=$1
-                            WHERE settings.user_id=$2;
-                        """
-                await self.bot.db.execute(query, settings["blocked_channels"], user_id)
+                await self.update_user_settings(user_id, blocked_channels=settings["blocked_channels"] - {entity.id})
                 return f":white_check_mark: Unblocked {entity.mention}."
 
     async def get_entity(self, ctx, entity):
@@ -449,7 +891,7 @@ class Highlight(commands.Cog):
     async def block(self, ctx, *, entity):
         converted_entity = await self.get_entity(ctx, entity)
 
-        if not converted_entity or (isinstance(converted_entity, discord.TextChannel) and ctx.author not in converted_entity.members):
+        if not converted_entity or (isinstance(converted_entity, discord.TextChannel) and not self.can_see(converted_entity, ctx.author)):
             return await ctx.send(f"User or channel `{entity}` not found.", delete_after=5)
 
         result = await self.do_block(ctx.author.id, converted_entity)
@@ -532,11 +974,7 @@ class Highlight(commands.Cog):
         if not settings["blocked_users"] and not settings["blocked_channels"]:
             return await ctx.send("You have no users or channels blocked.", delete_after=5, ephemeral=True)
 
-        query = """UPDATE settings
-                   SET blocked_users=$1, blocked_channels=$2
-                   WHERE settings.user_id=$3;
-                """
-        await self.bot.db.execute(query, [], [], ctx.author.id)
+        await self.update_user_settings(ctx.author.id, blocked_users=(), blocked_channels=())
 
         await ctx.send(f":white_check_mark: Your blocked users and channels have been cleared.", ephemeral=True)
 
@@ -549,13 +987,8 @@ class Highlight(commands.Cog):
 
         timers = self.bot.get_cog("Timers")
         await timers.cancel_timer(ctx.author.id, "disable")
-
-        query = """INSERT INTO settings (user_id, disabled, blocked_users, blocked_channels)
-                   VALUES ($1, $2, $3, $4)
-                   ON CONFLICT (user_id)
-                   DO UPDATE SET disabled=$2;
-                """
-        await self.bot.db.execute(query, ctx.author.id, False, [], [])
+        await self.update_user_settings(ctx.author.id, disabled=False)
+        self.unreachable.clear(ctx.author.id)
 
         await ctx.send(":white_check_mark: Highlight has been enabled.", delete_after=5, ephemeral=True)
 
@@ -570,13 +1003,7 @@ class Highlight(commands.Cog):
         timers = self.bot.get_cog("Timers")
 
         await timers.cancel_timer(ctx.author.id, "disable")
-
-        query = """INSERT INTO settings (user_id, disabled, blocked_users, blocked_channels)
-                   VALUES ($1, $2, $3, $4)
-                   ON CONFLICT (user_id)
-                   DO UPDATE SET disabled=$2;
-                """
-        await self.bot.db.execute(query, ctx.author.id, True, [], [])
+        await self.update_user_settings(ctx.author.id, disabled=True)
 
         query = """DELETE FROM timers
                    WHERE timers.event='disabled' AND timers.data=$2;
@@ -590,20 +1017,151 @@ class Highlight(commands.Cog):
         else:
             await ctx.send(":no_entry_sign: Highlight has been disabled until you enable it again.", delete_after=5, ephemeral=True)
 
+    @commands.hybrid_command(name="cooldown", description="View or change how long to wait before highlighting you again in the same channel")
+    @commands.guild_only()
+    async def cooldown(self, ctx, seconds: typing.Optional[commands.Range[int, 0, 3600]]):
+        settings = await self.get_user_settings(ctx.author.id)
+
+        if seconds is None:
+            cooldown = self.get_cooldown(settings)
+            if not cooldown:
+                return await ctx.send("You don't have a highlight cooldown.", delete_after=5, ephemeral=True)
+            return await ctx.send(f"You won't be highlighted again in a channel for {formats.plural(cooldown):second} after a highlight there.", delete_after=5, ephemeral=True)
+
+        await self.update_user_settings(ctx.author.id, cooldown=seconds)
+
+        if seconds:
+            await ctx.send(f":white_check_mark: You won't be highlighted again in a channel for {formats.plural(seconds):second} after a highlight there.", delete_after=5, ephemeral=True)
+        else:
+            await ctx.send(":white_check_mark: Your highlight cooldown has been turned off.", delete_after=5, ephemeral=True)
+
+    @commands.hybrid_command(name="history", description="See the highlights you've been sent")
+    @commands.guild_only()
+    async def history(self, ctx, *, flags: HistoryFlags):
+        conditions = ["highlights.user_id=$1"]
+        args = [ctx.author.id]
+
+        if flags.server:
+            args.append(ctx.guild.id)
+            conditions.append(f"highlights.guild_id=${len(args)}")
+        if flags.channel:
+            args.append(flags.channel.id)
+            conditions.append(f"highlights.channel_id=${len(args)}")
+        if flags.word:
+            args.append(patterns.normalize(flags.word))
+            conditions.append(f"highlights.word=${len(args)}")
+
+        async def fetch(key, limit):
+            # Keyset pagination, so a deep page costs the same as the first
+            key_condition = f"AND (highlights.invoked_at, highlights.message_id) < (${len(args)+1}, ${len(args)+2})" if key else ""
+            query = f"""SELECT highlights.guild_id, highlights.channel_id, highlights.message_id, highlights.word, highlights.invoked_at
+                        FROM highlights
+                        WHERE {" AND ".join(conditions)} {key_condition}
+                        ORDER BY highlights.invoked_at DESC, highlights.message_id DESC
+                        LIMIT {limit};
+                     """
+            return await self.bot.db.fetch(query, *args, *(key or ()))
+
+        def format_page(menu, rows):
+            em = discord.Embed(title="Highlight History", description="", color=discord.Color.blurple())
+            em.set_author(name=ctx.author.display_name, icon_url=ctx.author.display_avatar.url)
+
+            for row in rows:
+                guild = self.bot.get_guild(row["guild_id"])
+                jump_url = f"https://discord.com/channels/{row['guild_id']}/{row['channel_id']}/{row['message_id']}"
+                em.description += f"\n<t:{int(row['invoked_at'].timestamp())}:R> **{discord.utils.escape_markdown(row['word'])}** in <#{row['channel_id']}>{f' (`{discord.utils.escape_markdown(guild.name)}`)' if guild else ''} - [Jump]({jump_url})"
+
+            em.set_footer(text=f"Page {menu.current_page+1}")
+            return em
+
+        pages = menus.KeysetPages(fetch, lambda row: (row["invoked_at"], row["message_id"]), format_page)
+        await pages.load(0)
+
+        if not pages.rows:
+            return await ctx.send("You have no highlights to show.", delete_after=5, ephemeral=True)
+
+        # Sent in DMs, since highlights are private
+        try:
+            await pages.start(ctx, channel=await ctx.author.create_dm())
+        except discord.Forbidden:
+            return await ctx.send("I couldn't DM you your highlight history.", delete_after=5, ephemeral=True)
+
+        await ctx.send(":mailbox_with_mail: Sent your highlight history to your DMs.", delete_after=5, ephemeral=True)
+
+    @commands.hybrid_command(name="export", description="Export your highlight words, settings and history")
+    @commands.cooldown(1, 600, commands.BucketType.user)
+    @commands.max_concurrency(2)
+    async def export(self, ctx, format: typing.Literal["json", "csv"] = "json"):
+        await ctx.defer(ephemeral=True)
+
+        tables = [
+            ("words", ["guild_id", "word"], "SELECT words.guild_id, words.word FROM words WHERE words.user_id=$1 ORDER BY words.guild_id, words.word;"),
+            ("settings", ["disabled", "blocked_users", "blocked_channels", "cooldown"], "SELECT settings.disabled, settings.blocked_users, settings.blocked_channels, settings.cooldown FROM settings WHERE settings.user_id=$1;"),
+            ("highlights", ["guild_id", "channel_id", "message_id", "author_id", "word", "invoked_at"], "SELECT highlights.guild_id, highlights.channel_id, highlights.message_id, highlights.author_id, highlights.word, highlights.invoked_at FROM highlights WHERE highlights.user_id=$1 ORDER BY highlights.invoked_at, highlights.message_id;")
+        ]
+
+        # Rows are streamed through a cursor and compressed as they come in, so only a
+        # batch is ever in memory, and the file only goes to disk if it gets big
+        file = tempfile.SpooledTemporaryFile(max_size=8*1024*1024)
+        writer = export.FORMATS[format](file)
+
+        async with self.bot.db.acquire() as connection:
+            async with connection.transaction(readonly=True, isolation="repeatable_read"):
+                for table, columns, query in tables:
+                    writer.start_table(table, columns)
+
+                    cursor = await connection.cursor(query, ctx.author.id)
+                    while rows := await cursor.fetch(500):
+                        writer.add_rows(rows)
+
+        writer.close()
+        size = file.tell()
+        file.seek(0)
+
+        if size > 10*1024*1024:
+            file.close()
+            return await ctx.send("Your export is too big to send.", ephemeral=True)
+
+        try:
+            await ctx.author.send("Here's your highlight data export.", file=discord.File(file, filename=f"highlight-{ctx.author.id}.{writer.extension}"))
+        except discord.Forbidden:
+            return await ctx.send("I couldn't DM you your export.", ephemeral=True)
+        finally:
+            file.close()
+
+        await ctx.send(":mailbox_with_mail: Sent your export to your DMs.", ephemeral=True)
+
     @commands.hybrid_command(name="stats", description="View stats about the bot")
     async def stats(self, ctx):
         async with ctx.typing():
             em = discord.Embed(title="Highlight Stats", color=discord.Color.blurple())
 
-            highlights = await self.bot.db.fetchrow("SELECT COUNT(*) FROM highlights;")
-            em.add_field(name="Total Highlights", value=highlights["count"])
+            em.add_field(name="Total Highlights", value=await self.get_highlight_count())
 
             if ctx.guild:
-                highlights_here = await self.bot.db.fetchrow("SELECT COUNT(*) FROM highlights WHERE highlights.guild_id=$1;", ctx.guild.id)
-                em.add_field(name="Total Highlights Here", value=highlights_here["count"])
+                em.add_field(name="Total Highlights Here", value=await self.get_highlight_count(ctx.guild.id))
+
+            em.add_field(name="Suppressed by Cooldowns", value=self.rejections["cooldown"])
 
         await ctx.send(embed=em)
 
+    async def get_highlight_count(self, guild_id=None):
+        count = self._stats_cache.get(guild_id)
+        if count is not None:
+            return count
+
+        if guild_id:
+            query = """SELECT COALESCE(SUM(highlight_counters.count), 0) AS count
+                       FROM highlight_counters
+                       WHERE highlight_counters.guild_id=$1;
+                    """
+            count = await self.bot.db.fetchval(query, guild_id)
+        else:
+            count = await self.bot.db.fetchval("SELECT COALESCE(SUM(highlight_counters.count), 0) AS count FROM highlight_counters;")
+
+        self._stats_cache[guild_id] = count
+        return count
+
     @add.before_invoke
     @remove.before_invoke
     @show.before_invoke
@@ -615,6 +1173,8 @@ class Highlight(commands.Cog):
     @blocked_clear.before_invoke
     @enable.before_invoke
     @disable.before_invoke
+    @cooldown.before_invoke
+    @history.before_invoke
     async def ensure_privacy(self, ctx):
         if ctx.interaction:
             return
@@ -626,28 +1186,15 @@ class Highlight(commands.Cog):
 
     @commands.Cog.listener()
     async def on_disabled_complete(self, timer):
-        query = """INSERT INTO settings (user_id, disabled)
-                   VALUES ($1, $2)
-                   ON CONFLICT (user_id)
-                   DO UPDATE SET disabled=$2;
-                """
-        await self.bot.db.execute(query, timer["user_id"], False)
+        await self.update_user_settings(timer["user_id"], disabled=False)
 
-    async def bulk_insert(self):
-        query = """INSERT INTO highlights (guild_id, channel_id, message_id, author_id, user_id, word, invoked_at)
-                   SELECT x.guild_id, x.channel_id, x.message_id, x.author_id, x.user_id, x.word, x.invoked_at
-                   FROM jsonb_to_recordset($1::jsonb) AS
-                   x(guild_id BIGINT, channel_id BIGINT, message_id BIGINT, author_id BIGINT, user_id BIGINT, word TEXT, invoked_at TEXT)
-                """
-        if self._highlight_batch:
-            await self.bot.db.execute(query, self._highlight_batch)
-            total = len(self._highlight_batch)
-            self._highlight_batch.clear()
+    async def insert_highlights(self, records):
+        async with self.bot.db.acquire() as connection:
+            await db.insert_highlights(connection, records)
 
     @tasks.loop(seconds=20)
     async def bulk_insert_loop(self):
-        async with self._batch_lock:
-            await self.bulk_insert()
+        await self._highlight_batch.flush()
 
     @bulk_insert_loop.before_loop
     async def before_bulk_insert_loop(self):
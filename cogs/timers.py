@@ -3,16 +3,28 @@ from discord.ext import commands
 from discord.ext import tasks
 
 import asyncio
+import asyncpg
 import datetime
 import humanize
+import logging
+import re
+
+log = logging.getLogger("cogs.timers")
+
+def add_months(date, months):
+    total = date.year*12 + date.month-1 + months
+    return datetime.date(total//12, total%12+1, 1)
 
 class Timers(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
         self.loop.start()
+        self.partition_loop.add_exception_type(asyncpg.PostgresError)
+        self.partition_loop.start()
 
     def cog_unload(self):
         self.loop.cancel()
+        self.partition_loop.cancel()
 
     async def create_timer(self, user_id, event, time, extra):
         query = """INSERT INTO timers (user_id, event, time, extra)
@@ -43,5 +55,39 @@ class Timers(commands.Cog):
     async def before_loop(self):
         await self.bot.wait_until_ready()
 
+    @tasks.loop(hours=12)
+    async def partition_loop(self):
+        today = datetime.datetime.utcnow().date()
+
+        # Stay a few months ahead, so highlights never end up in the default partition
+        for months in range(3):
+            await self.bot.db.execute("SELECT create_highlight_partition($1);", add_months(today, months))
+
+        retention = getattr(self.bot.config, "highlight_retention_months", None)
+        if not retention:
+            return
+
+        query = """SELECT child.relname
+                   FROM pg_inherits
+                   INNER JOIN pg_class AS parent ON pg_inherits.inhparent=parent.oid
+                   INNER JOIN pg_class AS child ON pg_inherits.inhrelid=child.oid
+                   WHERE parent.relname='highlights';
+                """
+        partitions = await self.bot.db.fetch(query)
+        cutoff = add_months(today, -retention)
+
+        for partition in partitions:
+            match = re.fullmatch(r"highlights_(\d{4})_(\d{2})", partition["relname"])
+            if not match or datetime.date(int(match.group(1)), int(match.group(2)), 1) >= cutoff:
+                continue
+
+            # Dropping a whole month is much cheaper than deleting its rows
+            log.info("Dropping expired highlight partition %s", partition["relname"])
+            await self.bot.db.execute(f'DROP TABLE IF EXISTS "{partition["relname"]}";')
+
+    @partition_loop.before_loop
+    async def before_partition_loop(self):
+        await self.bot.wait_until_ready()
+
 async def setup(bot):
     await bot.add_cog(Timers(bot))
@@ -0,0 +1,173 @@
+import collections
+import time
+
+class LRUCache:
+    """A dict that evicts the least recently used keys once it grows past a max size."""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def get(self, key, default=None):
+        try:
+            value = self._data[key]
+        except KeyError:
+            self.misses += 1
+            return default
+
+        self.hits += 1
+        self._data.move_to_end(key)
+        return value
+
+    def peek(self, key, default=None):
+        # Doesn't count towards the hit rate or mark the key as recently used
+        return self._data.get(key, default)
+
+    def __setitem__(self, key, value):
+        if self.maxsize <= 0:
+            return
+
+        self._data[key] = value
+        self._data.move_to_end(key)
+
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        return self._data.pop(key, default)
+
+    def clear(self):
+        self._data.clear()
+
+    @property
+    def hit_rate(self):
+        total = self.hits+self.misses
+        return self.hits/total if total else 0
+
+class TTLCache(LRUCache):
+    """An LRU cache whose values also expire after ttl seconds."""
+
+    def __init__(self, maxsize, ttl):
+        super().__init__(maxsize)
+        self.ttl = ttl
+
+    def get(self, key, default=None):
+        entry = self._data.get(key)
+        if entry is None or entry[0] <= time.monotonic():
+            self._data.pop(key, None)
+            self.misses += 1
+            return default
+
+        self.hits += 1
+        self._data.move_to_end(key)
+        return entry[1]
+
+    def peek(self, key, default=None):
+        entry = self._data.get(key)
+        return entry[1] if entry and entry[0] > time.monotonic() else default
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, (time.monotonic()+self.ttl, value))
+
+class RecentMessage:
+    """The little bit of a message that's needed to show it as history."""
+
+    __slots__ = ("id", "author", "content", "truncated", "created_at")
+
+    def __init__(self, id, author, content, created_at):
+        self.id = id
+        self.author = author
+        self.content = content[:50]
+        self.truncated = len(content) > 50
+        self.created_at = created_at
+
+    @classmethod
+    def from_message(cls, message):
+        return cls(message.id, str(message.author), message.content, message.created_at)
+
+class RecentMessages:
+    """Keeps the last few messages of recently active channels, as seen over the gateway."""
+
+    def __init__(self, size=10, channels=2000):
+        self.size = size
+        self.channels = LRUCache(channels)
+
+    def add(self, channel_id, message):
+        messages = self.channels.peek(channel_id)
+        if messages is None:
+            messages = collections.deque(maxlen=self.size)
+
+        messages.append(message)
+        self.channels[channel_id] = messages
+
+    def seed(self, channel_id, history):
+        # Merge in messages fetched over REST, keeping everything in order
+        messages = {message.id: message for message in self.channels.peek(channel_id, ())}
+        for message in history:
+            messages.setdefault(message.id, message)
+
+        self.channels[channel_id] = collections.deque(sorted(messages.values(), key=lambda message: message.id), maxlen=self.size)
+
+    def edit(self, channel_id, message_id, content):
+        for message in self.channels.peek(channel_id, ()):
+            if message.id == message_id:
+                message.content = content[:50]
+                message.truncated = len(content) > 50
+
+    def delete(self, channel_id, message_ids):
+        messages = self.channels.peek(channel_id)
+        if messages:
+            self.channels[channel_id] = collections.deque([message for message in messages if message.id not in message_ids], maxlen=self.size)
+
+    def before(self, channel_id, message_id, limit):
+        """Returns the last messages before a message, newest first, or None if they aren't all known."""
+
+        messages = self.channels.get(channel_id)
+        if messages is None:
+            return None
+
+        history = [message for message in reversed(messages) if message.id < message_id][:limit]
+        return history if len(history) == limit else None
+
+class Cooldowns:
+    """When each key's cooldown runs out, so repeats can be dropped without looking anything up."""
+
+    def __init__(self):
+        self._expires = {}
+        self._next_prune = 1024
+
+    def __len__(self):
+        return len(self._expires)
+
+    def active(self, key):
+        expires = self._expires.get(key)
+        if expires is None:
+            return False
+        elif expires <= time.monotonic():
+            del self._expires[key]
+            return False
+
+        return True
+
+    def start(self, key, duration):
+        if duration <= 0:
+            return
+
+        now = time.monotonic()
+        self._expires[key] = now + duration
+
+        # Most keys are never looked at again, so expired ones are swept out every so often
+        if len(self._expires) >= self._next_prune:
+            self._expires = {key: expires for key, expires in self._expires.items() if expires > now}
+            self._next_prune = max(1024, len(self._expires)*2)
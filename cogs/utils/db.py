@@ -0,0 +1,142 @@
+import asyncio
+import collections
+import datetime
+import itertools
+import json
+import logging
+import os
+import shutil
+
+import asyncpg
+
+log = logging.getLogger("cogs.utils.db")
+
+# Shared by the bot and worker.py, so highlights are recorded the same way from both
+
+HIGHLIGHT_COLUMNS = ("guild_id", "channel_id", "message_id", "author_id", "user_id", "word", "invoked_at")
+
+# Errors that mean the database can't be reached right now, rather than a bad batch
+OUTAGE_ERRORS = (OSError, asyncio.TimeoutError, asyncpg.PostgresConnectionError, asyncpg.InterfaceError, asyncpg.CannotConnectNowError)
+
+def highlight_record(message, user_id, word):
+    return (message.guild.id, message.channel.id, message.id, message.author.id, user_id, word, message.created_at)
+
+async def insert_highlights(connection, records):
+    # The daily counts per guild are kept in step with the rows, so stats never has to count them
+    counts = collections.Counter((record[0], record[-1].astimezone(datetime.timezone.utc).date()) for record in records)
+
+    query = """INSERT INTO highlight_counters (guild_id, day, count)
+               SELECT x.guild_id, x.day, x.count
+               FROM unnest($1::bigint[], $2::date[], $3::bigint[]) AS x(guild_id, day, count)
+               ON CONFLICT (guild_id, day)
+               DO UPDATE SET count=highlight_counters.count+EXCLUDED.count;
+            """
+
+    async with connection.transaction():
+        # Binary COPY straight from tuples, without going through JSON first
+        await connection.copy_records_to_table("highlights", records=records, columns=HIGHLIGHT_COLUMNS)
+        await connection.execute(query, [guild_id for guild_id, day in counts], [day for guild_id, day in counts], list(counts.values()))
+
+class HighlightBatch:
+    """Buffers highlight records, flushing them once there are enough of them or when flush is called.
+
+    Adding waits while a full batch is being flushed, so memory stays bounded. While the
+    database is down, batches are appended to a spill file instead, and replayed once it's back.
+    """
+
+    def __init__(self, insert, *, size=500, spill_path="highlights.spill"):
+        self.insert = insert
+        self.size = size
+        self.spill_path = spill_path
+        self.spilled = 0
+
+        self._records = []
+        self._lock = asyncio.Lock()
+
+    def __len__(self):
+        return len(self._records)
+
+    async def add(self, record):
+        self._records.append(record)
+
+        if len(self._records) >= self.size:
+            await self.flush()
+
+    async def flush(self):
+        async with self._lock:
+            # Anything added while we wait for the lock is flushed too
+            batch, self._records = self._records, []
+
+            if os.path.exists(self.spill_path):
+                try:
+                    await self.replay()
+                except OUTAGE_ERRORS as exc:
+                    log.warning("Couldn't reach the database, spilling %s highlights to %s: %s", len(batch), self.spill_path, exc)
+                    self.spill(batch)
+                    return
+
+            if not batch:
+                return
+
+            try:
+                await self.insert(batch)
+            except OUTAGE_ERRORS as exc:
+                log.warning("Couldn't reach the database, spilling %s highlights to %s: %s", len(batch), self.spill_path, exc)
+                self.spill(batch)
+            except Exception:
+                log.exception("Couldn't insert %s highlights, dropping them", len(batch))
+
+    def spill(self, batch):
+        with open(self.spill_path, "a") as file:
+            for record in batch:
+                *values, invoked_at = record
+                file.write(json.dumps([*values, invoked_at.isoformat()]) + "\n")
+            file.flush()
+            os.fsync(file.fileno())
+
+        self.spilled += len(batch)
+
+    async def replay(self):
+        # Replayed a batch at a time, so a long outage doesn't all end up in memory at once
+        replayed = 0
+
+        with open(self.spill_path, "rb") as file:
+            while True:
+                position = file.tell()
+                lines = list(itertools.islice(file, self.size))
+                if not lines:
+                    break
+
+                records = []
+                for line in lines:
+                    try:
+                        *values, invoked_at = json.loads(line)
+                        records.append((*values, datetime.datetime.fromisoformat(invoked_at)))
+                    except ValueError:
+                        # Most likely a line cut short by a crash
+                        log.warning("Skipping a bad line in %s", self.spill_path)
+
+                try:
+                    if records:
+                        await self.insert(records)
+                except OUTAGE_ERRORS:
+                    # Keep only what hasn't been inserted yet, so it isn't inserted twice later
+                    file.seek(position)
+                    with open(f"{self.spill_path}.tmp", "wb") as remaining:
+                        shutil.copyfileobj(file, remaining)
+                    os.replace(f"{self.spill_path}.tmp", self.spill_path)
+                    self.spilled -= replayed
+                    raise
+                except Exception:
+                    # Moved aside so one bad row can't block every flush after it
+                    log.exception("Couldn't replay %s spilled highlights, moving them to %s.bad", len(records), self.spill_path)
+                    with open(f"{self.spill_path}.bad", "ab") as bad:
+                        bad.writelines(lines)
+                    continue
+
+                replayed += len(records)
+
+        # Only removed after everything is inserted, so nothing is lost if it fails
+        os.remove(self.spill_path)
+        log.info("Replayed %s spilled highlights from %s", replayed, self.spill_path)
+        self.spilled = 0
@@ -0,0 +1,108 @@
+import asyncio
+import collections
+import logging
+import time
+
+log = logging.getLogger("cogs.utils.delivery")
+
+class DeliveryQueue:
+    """Delivers DMs with a fixed number of senders, merging the items for a user that arrive close together.
+
+    The first item for a user opens a window. Anything else for them that arrives before it
+    closes (or until there are max_batch items) goes out in the same DM.
+    """
+
+    def __init__(self, send, *, senders=4, window=2, max_batch=10):
+        self.send = send
+        self.senders = senders
+        self.window = window
+        self.max_batch = max_batch
+
+        self.sent = 0
+        self.failed = 0
+        self.send_latencies = collections.deque(maxlen=1000)
+        self.delivery_latencies = collections.deque(maxlen=1000)
+
+        self._pending = {} # user ID -> list of (queued at, item)
+        self._timers = {}
+        self._queue = asyncio.Queue()
+        self._tasks = []
+
+    @property
+    def depth(self):
+        return sum(len(items) for items in self._pending.values())
+
+    @property
+    def users(self):
+        return len(self._pending)
+
+    def start(self):
+        self._tasks = [asyncio.create_task(self.run()) for _ in range(self.senders)]
+
+    def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        for timer in self._timers.values():
+            timer.cancel()
+
+    def put(self, user_id, item):
+        items = self._pending.setdefault(user_id, [])
+        items.append((time.monotonic(), item))
+
+        if len(items) == 1:
+            self._timers[user_id] = asyncio.get_running_loop().call_later(self.window, self._ready, user_id)
+        elif len(items) >= self.max_batch:
+            self._ready(user_id)
+
+    def _ready(self, user_id):
+        timer = self._timers.pop(user_id, None)
+        if timer:
+            timer.cancel()
+            self._queue.put_nowait(user_id)
+
+    async def run(self):
+        while True:
+            user_id = await self._queue.get()
+            items = self._pending.pop(user_id, [])
+
+            for index in range(0, len(items), self.max_batch):
+                batch = items[index:index+self.max_batch]
+
+                start = time.monotonic()
+                try:
+                    await self.send(user_id, [item for queued_at, item in batch])
+                except Exception:
+                    self.failed += len(batch)
+                    log.exception("Failed to deliver to user ID %s", user_id)
+                    continue
+
+                end = time.monotonic()
+                self.sent += len(batch)
+                self.send_latencies.append(end-start)
+                self.delivery_latencies.extend(end-queued_at for queued_at, item in batch)
+
+class Unreachable:
+    """Users whose DMs are closed, so they aren't retried on every message.
+
+    Each failure doubles how long they're skipped for, starting at base seconds.
+    """
+
+    def __init__(self, base=60, maximum=86400):
+        self.base = base
+        self.maximum = maximum
+        self._users = {} # user ID -> (failures, when to try again)
+
+    def __len__(self):
+        return len(self._users)
+
+    def fail(self, user_id):
+        failures = self._users.get(user_id, (0, 0))[0] + 1
+        self._users[user_id] = (failures, time.monotonic() + min(self.base * 2 ** (failures-1), self.maximum))
+        return failures
+
+    def clear(self, user_id):
+        self._users.pop(user_id, None)
+
+    def skipped(self, user_id):
+        entry = self._users.get(user_id)
+        return entry is not None and entry[1] > time.monotonic()
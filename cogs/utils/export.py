@@ -0,0 +1,58 @@
+import csv
+import datetime
+import gzip
+import io
+import json
+import zipfile
+
+def to_json(value):
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    raise TypeError(f"Can't export {type(value).__name__}")
+
+class NDJSONExport:
+    """Newline delimited JSON, one object per row with the table it came from, gzipped as it's written."""
+
+    extension = "ndjson.gz"
+
+    def __init__(self, file):
+        self.file = gzip.GzipFile(fileobj=file, mode="wb")
+        self.table = None
+
+    def start_table(self, table, columns):
+        self.table = table
+
+    def add_rows(self, rows):
+        self.file.write("".join(json.dumps({"table": self.table, **row}, default=to_json) + "\n" for row in rows).encode("utf-8"))
+
+    def close(self):
+        self.file.close()
+
+class CSVExport:
+    """A zip file with a CSV file for each table, deflated as it's written."""
+
+    extension = "zip"
+
+    def __init__(self, file):
+        self.zip = zipfile.ZipFile(file, "w", zipfile.ZIP_DEFLATED)
+        self.file = None
+        self.writer = None
+
+    def start_table(self, table, columns):
+        self.close_table()
+        self.file = io.TextIOWrapper(self.zip.open(f"{table}.csv", "w"), encoding="utf-8", newline="")
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(columns)
+
+    def add_rows(self, rows):
+        self.writer.writerows([value.isoformat() if isinstance(value, datetime.datetime) else value for value in row.values()] for row in rows)
+
+    def close_table(self):
+        if self.file:
+            self.file.close()
+
+    def close(self):
+        self.close_table()
+        self.zip.close()
+
+FORMATS = {"json": NDJSONExport, "csv": CSVExport}
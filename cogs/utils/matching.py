@@ -0,0 +1,267 @@
+import collections
+import functools
+import re
+
+from . import patterns
+
+# A highlight word has to be at the start of the message or after a space (ignoring any
+# punctuation in between). It can be followed by repeated letters of the word, a plural
+# or possessive ending, or punctuation, and then either the end of the message or a space.
+HIGHLIGHT_REGEX = r"^(?:.+ )?(?:\W*)({word})(?:[{word}]*)(?:\W+|[(?:'|\")s]*)(?: .+)?$"
+
+TOKEN = re.compile(r"\w+")
+
+# The same rules split around the word, so a known occurrence can be checked in place
+PREFIX = re.compile(r"(?:.+ )?(?:\W*)")
+SUFFIX_REGEX = r"(?:[{word}]*)(?:\W+|[(?:'|\")s]*)(?: .+)?$"
+
+@functools.lru_cache(maxsize=8192)
+def highlight_pattern(word):
+    return re.compile(HIGHLIGHT_REGEX.format(word=re.escape(word)), re.I)
+
+@functools.lru_cache(maxsize=8192)
+def suffix_pattern(word):
+    return re.compile(SUFFIX_REGEX.format(word=re.escape(word)), re.I)
+
+def is_highlight(content, start, end, word):
+    """Checks if an occurrence of a word at content[start:end] follows the highlight rules."""
+
+    return PREFIX.fullmatch(content, 0, start) is not None and suffix_pattern(word).match(content, end) is not None
+
+class Automaton:
+    """An Aho-Corasick automaton that finds every occurrence of a set of words in one pass."""
+
+    def __init__(self, words):
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [()]
+
+        for word in words:
+            state = 0
+            for char in word:
+                next_state = self.goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self.goto)
+                    self.goto[state][char] = next_state
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append(())
+                state = next_state
+
+            self.output[state] = (word,)
+
+        # Breadth first, so the failure state of a node is always built before the node
+        queue = list(self.goto[0].values())
+        for state in queue:
+            for char, next_state in self.goto[state].items():
+                queue.append(next_state)
+
+                fail = self.fail[state]
+                while fail and char not in self.goto[fail]:
+                    fail = self.fail[fail]
+
+                fail = self.goto[fail].get(char, 0)
+                self.fail[next_state] = fail
+                self.output[next_state] += self.output[fail]
+
+    def iter(self, text):
+        goto, fail, output = self.goto, self.fail, self.output
+        state = 0
+
+        for index, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+
+            state = goto[state].get(char, 0)
+            for word in output[state]:
+                yield index+1-len(word), index+1, word
+
+class RegexMatcher:
+    """Matches the highlight regex of every word against the message, one word at a time."""
+
+    def __init__(self, words):
+        self.words = tuple(words)
+
+    def find(self, content):
+        """Returns a dict of each matched word to the span of its occurrence."""
+
+        matches = {}
+        for word in self.words:
+            match = highlight_pattern(word).match(content)
+            if match:
+                matches[word] = match.span(1)
+
+        return matches
+
+class AutomatonMatcher:
+    """Finds the highlight words of a guild in a message with a single automaton."""
+
+    def __init__(self, words):
+        self.words = tuple(words)
+        self.automaton = Automaton(self.words)
+
+    def find(self, content):
+        """Returns a dict of each matched word to the span of its first valid occurrence."""
+
+        lowered = content.lower()
+
+        # Lowercasing a few characters changes the length of the string, so the
+        # offsets from the automaton wouldn't line up with the original content
+        if len(lowered) != len(content):
+            return RegexMatcher(self.words).find(content)
+
+        matches = {}
+        for start, end, word in self.automaton.iter(lowered):
+            if word not in matches and is_highlight(content, start, end, word):
+                matches[word] = (start, end)
+
+        return matches
+
+class TokenMatcher:
+    """Tokenizes a message once and looks up each token in the guild's words.
+
+    Words that are a single token are found with hash lookups against the casefolded
+    tokens. Words that span several tokens (like ``new york`` or ``c++``) are looked up
+    by their first token, and the rare word that doesn't start with one falls back to
+    the automaton.
+    """
+
+    def __init__(self, words):
+        self.words = tuple(words)
+        self.tokens = {}
+        self.leads = {}
+        others = []
+
+        for word in self.words:
+            lead = TOKEN.match(word)
+            if lead and lead.end() == len(word):
+                self.tokens[word.casefold()] = word
+            elif lead:
+                self.leads.setdefault(lead.group(), []).append(word)
+            else:
+                others.append(word)
+
+        self.longest = max(map(len, self.tokens), default=0)
+        self.others = AutomatonMatcher(others) if others else None
+
+    def find(self, content):
+        """Returns a dict of each matched word to the span of its first valid occurrence."""
+
+        matches = {}
+        if self.tokens or self.leads:
+            for token in TOKEN.finditer(content):
+                for word, span in self.find_token(content, token):
+                    if word not in matches:
+                        matches[word] = span
+
+        if self.others:
+            for word, span in self.others.find(content).items():
+                if word not in matches:
+                    matches[word] = span
+
+            matches = dict(sorted(matches.items(), key=lambda item: item[1]))
+
+        return matches
+
+    def find_token(self, content, token):
+        original = token.group()
+        folded = original.casefold()
+        start = token.start()
+
+        if self.leads:
+            for word in self.leads.get(original.lower(), ()):
+                end = start+len(word)
+                if content[start:end].lower() == word and is_highlight(content, start, end, word):
+                    yield word, (start, end)
+
+        # A word can only start a token, and it can only be followed by its own letters
+        # and a plural ending inside of it, so only a few prefixes are ever looked up
+        for length in range(min(len(folded), self.longest), 1, -1):
+            # Shorter prefixes can't contain this letter either, so none of them can match
+            if length < len(folded) and folded[length] != "s" and folded[length] not in folded[:length]:
+                break
+
+            word = self.tokens.get(folded[:length])
+            if not word or any(char != "s" and char not in word for char in folded[length:]):
+                continue
+
+            end = self.original_end(original, length)
+            if end is not None and is_highlight(content, start, start+end, word):
+                yield word, (start, start+end)
+
+    def original_end(self, original, length):
+        # Casefolding can expand a character (ß -> ss), so map the end back to the original
+        if len(original) == len(original.casefold()):
+            return length
+
+        folded = 0
+        for index, char in enumerate(original):
+            if folded == length:
+                return index
+            folded += len(char.casefold())
+
+        if folded == length:
+            return len(original)
+
+ENGINES = {
+    "regex": RegexMatcher,
+    "automaton": AutomatonMatcher,
+    "tokens": TokenMatcher
+}
+
+class GuildMatcher:
+    """Matches the plain words of a guild with an engine, and its patterns in one combined scan."""
+
+    def __init__(self, engine, words):
+        plain = []
+        compiled = []
+
+        for word in words:
+            if not patterns.is_pattern(word):
+                plain.append(word)
+                continue
+
+            try:
+                compiled.append(patterns.Pattern(word))
+            except patterns.PatternError:
+                # Added before the limits were lowered, or directly to the database
+                pass
+
+        self.words = ENGINES[engine](plain)
+        self.patterns = patterns.PatternSet(compiled) if compiled else None
+
+    def find(self, content, budget=patterns.BUDGET):
+        matches = self.words.find(content)
+
+        if self.patterns:
+            for word, span in self.patterns.find(content, budget).items():
+                matches.setdefault(word, span)
+
+        return matches
+
+def find_highlights(matcher, words, content, budget=patterns.BUDGET):
+    """Returns a list of (user_id, word, span) for everyone highlighted by a message."""
+
+    return [(user_id, word, span) for word, span in matcher.find(content, budget).items() for user_id in words[word]]
+
+# Matchers kept warm in each process of the match pool, keyed by guild ID and engine
+_worker_matchers = collections.OrderedDict()
+WORKER_MATCHERS = 128
+
+def find_in_worker(guild_id, version, engine, content, budget, words=None):
+    """Runs in a match pool process. Returns None if the words of the guild need to be sent."""
+
+    key = (guild_id, engine)
+    cached = _worker_matchers.get(key)
+
+    if cached and cached[0] == version:
+        _worker_matchers.move_to_end(key)
+    elif words is None:
+        return None
+    else:
+        cached = _worker_matchers[key] = (version, GuildMatcher(engine, words), words)
+        if len(_worker_matchers) > WORKER_MATCHERS:
+            _worker_matchers.popitem(last=False)
+
+    version, matcher, words = cached
+    return find_highlights(matcher, words, content, budget)
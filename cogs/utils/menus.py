@@ -22,3 +22,58 @@ class Confirm(menus.Menu):
     async def prompt(self, ctx):
         await self.start(ctx, wait=True)
         return self.result
+
+class KeysetPages(menus.Menu):
+    """Pages through a query one page at a time, using the last row of each page as the key for the next.
+
+    fetch(key, limit) returns the rows after key (or the first rows if it's None), and key(row)
+    makes a key from a row. Keys for pages already seen are kept, so going back doesn't need an
+    OFFSET either.
+    """
+
+    def __init__(self, fetch, key, format_page, *, per_page=10):
+        super().__init__(timeout=120.0, clear_reactions_after=True)
+        self.fetch = fetch
+        self.key = key
+        self.format_page = format_page
+        self.per_page = per_page
+
+        self.keys = [None]
+        self.current_page = 0
+        self.rows = []
+        self.has_next = False
+
+    async def load(self, page):
+        # One extra row says whether there's a next page without counting anything
+        rows = await self.fetch(self.keys[page], self.per_page+1)
+
+        self.current_page = page
+        self.rows = rows[:self.per_page]
+        self.has_next = len(rows) > self.per_page
+
+        if self.has_next and len(self.keys) == page+1:
+            self.keys.append(self.key(self.rows[-1]))
+
+    async def send_initial_message(self, ctx, channel):
+        if not self.rows:
+            await self.load(0)
+
+        return await channel.send(embed=self.format_page(self, self.rows))
+
+    async def show_page(self, page):
+        await self.load(page)
+        await self.message.edit(embed=self.format_page(self, self.rows))
+
+    @menus.button("\N{BLACK LEFT-POINTING TRIANGLE}\ufe0f")
+    async def previous_page(self, payload):
+        if self.current_page > 0:
+            await self.show_page(self.current_page-1)
+
+    @menus.button("\N{BLACK RIGHT-POINTING TRIANGLE}\ufe0f")
+    async def next_page(self, payload):
+        if self.has_next:
+            await self.show_page(self.current_page+1)
+
+    @menus.button("\N{BLACK SQUARE FOR STOP}\ufe0f")
+    async def stop_pages(self, payload):
+        self.stop()
@@ -0,0 +1,286 @@
+import time
+
+# Patterns are written between slashes, like /colou?r/ or /deploy\w*/. They support
+# literals, ., [classes], \w \d \s (and \W \D \S), groups, | and the * + ? quantifiers.
+# They are compiled to an NFA and simulated without backtracking, so matching is
+# linear in the length of the message no matter what the pattern looks like.
+
+MAX_LENGTH = 50 # longest pattern, including the slashes
+MAX_STATES = 64 # most NFA states a single pattern can compile to
+MIN_LITERALS = 2 # patterns need some literal characters, so they can't match everything
+BUDGET = 0.005 # seconds of CPU time a guild's patterns get per message
+
+CHAR, SPLIT, MATCH = range(3)
+
+class PatternError(Exception):
+    pass
+
+def is_pattern(word):
+    return len(word) > 2 and word.startswith("/") and word.endswith("/")
+
+def normalize(word):
+    # Messages are lowercased before matching, but \W, \D and \S mean something else lowercased
+    if not is_pattern(word):
+        return word.lower()
+
+    chars = []
+    escaped = False
+    for char in word:
+        chars.append(char if escaped else char.lower())
+        escaped = not escaped and char == "\\"
+
+    return "".join(chars)
+
+def is_word(char):
+    return char.isalnum() or char == "_"
+
+CLASSES = {
+    "w": is_word,
+    "d": str.isdigit,
+    "s": str.isspace
+}
+
+class Parser:
+    def __init__(self, source):
+        self.source = source
+        self.index = 0
+        self.literals = 0
+
+    def peek(self):
+        return self.source[self.index] if self.index < len(self.source) else None
+
+    def next(self):
+        char = self.peek()
+        if char is None:
+            raise PatternError("The pattern ended unexpectedly")
+
+        self.index += 1
+        return char
+
+    def parse(self):
+        node = self.parse_alternation()
+        if self.peek() is not None:
+            raise PatternError(f"Unexpected `{self.peek()}` at position {self.index+1}")
+
+        return node
+
+    def parse_alternation(self):
+        branches = [self.parse_concatenation()]
+        while self.peek() == "|":
+            self.index += 1
+            branches.append(self.parse_concatenation())
+
+        return ("alt", branches) if len(branches) > 1 else branches[0]
+
+    def parse_concatenation(self):
+        nodes = []
+        while self.peek() not in (None, "|", ")"):
+            nodes.append(self.parse_repeat())
+
+        return ("cat", nodes)
+
+    def parse_repeat(self):
+        node = self.parse_atom()
+        while self.peek() in ("*", "+", "?"):
+            node = ({"*": "star", "+": "plus", "?": "optional"}[self.next()], node)
+
+        return node
+
+    def parse_atom(self):
+        char = self.next()
+
+        if char == "(":
+            node = self.parse_alternation()
+            if self.peek() != ")":
+                raise PatternError("Missing a closing `)`")
+            self.index += 1
+            return node
+        elif char == "[":
+            return ("char", self.parse_class())
+        elif char == ".":
+            return ("char", lambda char: char != "\n")
+        elif char == "\\":
+            return ("char", self.parse_escape())
+        elif char in "*+?":
+            raise PatternError(f"Nothing to repeat at position {self.index}")
+        elif char in ")]{}":
+            raise PatternError(f"Unexpected `{char}` at position {self.index}")
+
+        self.literals += 1
+        return ("char", char.__eq__)
+
+    def parse_escape(self):
+        char = self.next()
+
+        if char.lower() in CLASSES:
+            test = CLASSES[char.lower()]
+            return test if char.islower() else lambda char: not test(char)
+        elif char.isalnum():
+            raise PatternError(f"Unknown escape `\\{char}`")
+
+        self.literals += 1
+        return char.__eq__
+
+    def parse_class(self):
+        negated = self.peek() == "^"
+        if negated:
+            self.index += 1
+
+        tests = []
+        chars = set()
+
+        while self.peek() != "]":
+            char = self.next()
+
+            if char == "\\":
+                escaped = self.next()
+                if escaped.lower() in CLASSES:
+                    test = CLASSES[escaped.lower()]
+                    tests.append(test if escaped.islower() else lambda char, test=test: not test(char))
+                    continue
+                char = escaped
+
+            if self.peek() == "-" and self.source[self.index+1:self.index+2] not in ("]", ""):
+                self.index += 1
+                end = self.next()
+                if end < char:
+                    raise PatternError(f"Invalid range `{char}-{end}`")
+                tests.append(lambda value, start=char, end=end: start <= value <= end)
+            else:
+                chars.add(char)
+
+        self.index += 1
+        chars = frozenset(chars)
+
+        return lambda char: (char in chars or any(test(char) for test in tests)) != negated
+
+class Pattern:
+    """A single compiled pattern."""
+
+    def __init__(self, word):
+        if not is_pattern(word):
+            raise PatternError("Patterns have to be wrapped in slashes")
+        elif len(word) > MAX_LENGTH:
+            raise PatternError(f"Patterns cannot contain more than {MAX_LENGTH} characters")
+
+        parser = Parser(word[1:-1])
+        self.word = word
+        self.tree = parser.parse()
+
+        if parser.literals < MIN_LITERALS:
+            raise PatternError(f"Patterns must contain at least {MIN_LITERALS} regular characters")
+
+        # Compile it once on its own, to check its size and that it can't match nothing
+        automaton = PatternSet([self])
+        if len(automaton.kinds) - 1 > MAX_STATES:
+            raise PatternError("This pattern is too complex")
+        elif any(automaton.kinds[state] == MATCH for state in automaton.start):
+            raise PatternError("Patterns cannot match an empty message")
+
+        self.states = len(automaton.kinds) - 1
+
+class PatternSet:
+    """All of a guild's patterns combined into a single NFA, so a message is scanned once."""
+
+    def __init__(self, patterns):
+        self.words = []
+        self.kinds = []
+        self.tests = []
+        self.outs = []
+        self.exceeded = 0
+
+        starts = []
+        for pattern in patterns:
+            match = self.add_state(MATCH, len(self.words), ())
+            self.words.append(pattern.word)
+            starts.append(self.emit(pattern.tree, match))
+
+        start = self.add_state(SPLIT, None, starts)
+        self.closures = [self.closure(state) for state in range(len(self.kinds))]
+        self.start = self.closures[start]
+
+    def add_state(self, kind, test, outs):
+        self.kinds.append(kind)
+        self.tests.append(test)
+        self.outs.append(outs)
+        return len(self.kinds) - 1
+
+    def emit(self, node, next_state):
+        # Compiled back to front, so every state already knows where it goes next
+        kind = node[0]
+
+        if kind == "char":
+            return self.add_state(CHAR, node[1], (next_state,))
+        elif kind == "cat":
+            for child in reversed(node[1]):
+                next_state = self.emit(child, next_state)
+            return next_state
+        elif kind == "alt":
+            return self.add_state(SPLIT, None, [self.emit(child, next_state) for child in node[1]])
+        elif kind == "optional":
+            return self.add_state(SPLIT, None, [self.emit(node[1], next_state), next_state])
+
+        loop = self.add_state(SPLIT, None, [])
+        body = self.emit(node[1], loop)
+        self.outs[loop] = [body, next_state]
+        return loop if kind == "star" else body
+
+    def closure(self, state):
+        found = []
+        seen = set()
+        stack = [state]
+
+        while stack:
+            state = stack.pop()
+            if state in seen:
+                continue
+            seen.add(state)
+
+            if self.kinds[state] == SPLIT:
+                stack.extend(reversed(self.outs[state]))
+            else:
+                found.append(state)
+
+        return tuple(found)
+
+    def find(self, content, budget=BUDGET):
+        """Returns a dict of each matched pattern to the span of its first match."""
+
+        text = content.lower()
+        if len(text) != len(content):
+            text = [char if len(char.lower()) != 1 else char.lower() for char in content]
+
+        kinds, tests, outs, closures = self.kinds, self.tests, self.outs, self.closures
+        deadline = time.process_time() + budget
+        matches = {}
+        current = {} # state -> earliest start of a thread in it
+
+        for index in range(len(text)+1):
+            # Patterns only match whole words
+            if index == 0 or not is_word(text[index-1]):
+                for state in self.start:
+                    current.setdefault(state, index)
+
+            if index == len(text) or not is_word(text[index]):
+                for state, start in current.items():
+                    if kinds[state] == MATCH and start < index:
+                        matches.setdefault(self.words[tests[state]], (start, index))
+
+            if index == len(text) or len(matches) == len(self.words):
+                break
+
+            char = text[index]
+            stepped = {}
+            for state, start in current.items():
+                if kinds[state] == CHAR and tests[state](char):
+                    for next_state in closures[outs[state][0]]:
+                        if start < stepped.get(next_state, index+1):
+                            stepped[next_state] = start
+
+            current = stepped
+
+            if not index % 64 and time.process_time() > deadline:
+                self.exceeded += 1
+                break
+
+        return matches
@@ -0,0 +1,91 @@
+import discord
+
+# Discord's limits on the embeds in a single message
+MAX_EMBEDS = 10
+MAX_EMBED_LENGTH = 6000
+
+def split_embeds(items, embed=lambda item: item):
+    """Splits items into groups whose embeds fit in one message."""
+
+    groups = []
+    group = []
+    length = 0
+
+    for item in items:
+        size = len(embed(item))
+        if group and (len(group) >= MAX_EMBEDS or length+size > MAX_EMBED_LENGTH):
+            groups.append(group)
+            group = []
+            length = 0
+
+        group.append(item)
+        length += size
+
+    if group:
+        groups.append(group)
+
+    return groups
+
+class HighlightRender:
+    """Renders the highlight message for a message once, and shares it between everyone it highlights.
+
+    Only the word in the header and the bolded span differ between recipients, so full
+    descriptions are cached by (word, span) and everything else is built up front.
+    """
+
+    def __init__(self, message, history, guild_name=None):
+        # Messages fetched over REST by the delivery worker don't have a full guild, so it passes the name
+        self.message = message
+        self.header = f"In {message.channel.mention} for `{discord.utils.escape_markdown(guild_name or message.guild.name)}` you were highlighted with the word "
+        self.prefix = f"<t:{int(message.created_at.timestamp())}:t> {discord.utils.escape_markdown(str(message.author))}: "
+
+        # Newest first, like the history it's built from
+        self.history = []
+        for ms in history:
+            content = f"{ms.content}{'...' if ms.truncated else ''}"
+            self.history.append(f"<t:{int(ms.created_at.timestamp())}:t> {discord.utils.escape_markdown(ms.author)}: {discord.utils.escape_markdown(content)}\n")
+
+        self._descriptions = {}
+
+    def trigger(self, span):
+        content = self.message.content
+        text = discord.utils.escape_markdown(content[span[0]:span[1]])
+
+        # Keep the description within the embed limit, without losing the highlighted word
+        if len(content) > 2000 and span[1] > 2000:
+            start = min(200, span[0])
+            return f"{discord.utils.escape_markdown(content[:start])}... **{text}** ..."
+
+        trigger = f"{discord.utils.escape_markdown(content[:span[0]])}**{text}**{discord.utils.escape_markdown(content[span[1]:2000])}"
+        return f"{trigger}..." if len(content) > 2000 else trigger
+
+    def description(self, word, span):
+        key = (word, span)
+        if key in self._descriptions:
+            return self._descriptions[key]
+
+        initial_description = f"{self.header}**{discord.utils.escape_markdown(word)}**\n\n"
+        description = self.prefix + self.trigger(span)
+
+        for text in self.history:
+            if len(initial_description) + len(description) + len(text) <= 4096:
+                description = text + description
+
+        self._descriptions[key] = description = initial_description + description
+        return description
+
+    def embed(self, word, span):
+        em = discord.Embed(description=self.description(word, span), timestamp=self.message.created_at, color=discord.Color.blurple())
+        em.set_author(name=self.message.author.display_name, icon_url=self.message.author.display_avatar.url)
+        em.set_footer(text="Triggered")
+        return em
+
+class JumpBackView(discord.ui.View):
+    def __init__(self, *jump_urls):
+        super().__init__()
+
+        if len(jump_urls) == 1:
+            self.add_item(discord.ui.Button(url=jump_urls[0], label="Go to Message"))
+        else:
+            for counter, jump_url in enumerate(jump_urls, 1):
+                self.add_item(discord.ui.Button(url=jump_url, label=f"Go to Message {counter}"))
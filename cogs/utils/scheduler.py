@@ -0,0 +1,81 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+
+log = logging.getLogger("cogs.utils.scheduler")
+
+class ActivityScheduler:
+    """Holds items until their grace period ends, dropping them if the user is active in the channel first.
+
+    One heap of deadlines replaces a waiter per item, and activity is only recorded for
+    channels that have something pending, so every other event is dropped straight away.
+    """
+
+    def __init__(self, callback, delay=10):
+        self.callback = callback
+        self.delay = delay
+        self.released = 0
+        self.cancelled = 0
+
+        self._heap = []
+        self._pending = {} # channel ID -> number of pending items
+        self._activity = {} # channel ID -> user ID -> when they were last active
+        self._counter = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    def __len__(self):
+        return len(self._heap)
+
+    def start(self):
+        self._task = asyncio.create_task(self.run())
+
+    def stop(self):
+        if self._task:
+            self._task.cancel()
+
+    def schedule(self, channel_id, user_id, item):
+        now = time.monotonic()
+        heapq.heappush(self._heap, (now+self.delay, next(self._counter), channel_id, user_id, now, item))
+        self._pending[channel_id] = self._pending.get(channel_id, 0) + 1
+        self._wakeup.set()
+
+    def touch(self, channel_id, user_id):
+        if channel_id not in self._pending:
+            return
+
+        self._activity.setdefault(channel_id, {})[user_id] = time.monotonic()
+
+    async def run(self):
+        while True:
+            if not self._heap:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            delay = self._heap[0][0]-time.monotonic()
+            if delay > 0:
+                # Items are always scheduled with the same delay, so a new one never
+                # becomes the earliest deadline unless the heap was empty
+                await asyncio.sleep(delay)
+                continue
+
+            deadline, counter, channel_id, user_id, scheduled_at, item = heapq.heappop(self._heap)
+            last_active = self._activity.get(channel_id, {}).get(user_id)
+
+            self._pending[channel_id] -= 1
+            if not self._pending[channel_id]:
+                del self._pending[channel_id]
+                self._activity.pop(channel_id, None)
+
+            if last_active is not None and last_active >= scheduled_at:
+                self.cancelled += 1
+                continue
+
+            self.released += 1
+            try:
+                self.callback(item)
+            except Exception:
+                log.exception("Failed to release scheduled item")
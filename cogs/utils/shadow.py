@@ -0,0 +1,80 @@
+import collections
+import random
+import time
+
+class Disagreement:
+    def __init__(self, guild_id, channel_id, message_id, missing, extra):
+        self.guild_id = guild_id
+        self.channel_id = channel_id
+        self.message_id = message_id
+        self.missing = missing # (user ID, word) pairs only the primary engine found
+        self.extra = extra # (user ID, word) pairs only the candidate engine found
+
+    @property
+    def jump_url(self):
+        return f"https://discord.com/channels/{self.guild_id}/{self.channel_id}/{self.message_id}"
+
+class Shadow:
+    """Runs a candidate match engine beside the primary one on a sample of messages."""
+
+    def __init__(self, engine=None, rate=0.01, *, limit=600, keep=25):
+        self.engine = engine
+        self.rate = rate
+        self.limit = limit # most messages sampled per minute
+        self.recent = collections.deque(maxlen=keep)
+        self.reset()
+
+    def reset(self):
+        self.sampled = 0
+        self.disagreements = 0
+        self.primary_time = 0
+        self.candidate_time = 0
+        self.recent.clear()
+
+        self._window = 0
+        self._window_sampled = 0
+
+    def sample(self):
+        if not self.engine or random.random() >= self.rate:
+            return False
+
+        window = int(time.monotonic()//60)
+        if window != self._window:
+            self._window = window
+            self._window_sampled = 0
+
+        if self._window_sampled >= self.limit:
+            return False
+
+        self._window_sampled += 1
+        return True
+
+    def compare(self, guild_words, message, engine):
+        """Matches a message with both engines and returns the matches of the primary one."""
+
+        start = time.perf_counter_ns()
+        matches = guild_words.find(message.content, engine)
+        middle = time.perf_counter_ns()
+        candidate_matches = guild_words.find(message.content, self.engine)
+        end = time.perf_counter_ns()
+
+        self.sampled += 1
+        self.primary_time += middle-start
+        self.candidate_time += end-middle
+
+        expected = {(user_id, word) for user_id, word, span in matches}
+        found = {(user_id, word) for user_id, word, span in candidate_matches}
+
+        if expected != found:
+            self.disagreements += 1
+            self.recent.append(Disagreement(message.guild.id, message.channel.id, message.id, expected-found, found-expected))
+
+        return matches
+
+    @property
+    def primary_average(self):
+        return self.primary_time/self.sampled/1000 if self.sampled else 0
+
+    @property
+    def candidate_average(self):
+        return self.candidate_time/self.sampled/1000 if self.sampled else 0
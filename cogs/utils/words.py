@@ -0,0 +1,142 @@
+from . import matching, patterns
+
+class GuildWords:
+    """The highlight words of a single guild."""
+
+    def __init__(self, guild_id):
+        self.guild_id = guild_id
+        self.words = {} # word -> set of user IDs
+        self.users = {} # user ID -> set of words
+        self.version = 0
+
+        self._matchers = {}
+        self._snapshot = (None, None)
+
+    def __len__(self):
+        return len(self.words)
+
+    def __bool__(self):
+        return bool(self.words)
+
+    def matcher(self, engine="automaton"):
+        # Rebuilt lazily, so a burst of changes only costs one rebuild on the next message
+        version, matcher = self._matchers.get(engine, (None, None))
+        if version != self.version:
+            matcher = matching.GuildMatcher(engine, self.words)
+            self._matchers[engine] = (self.version, matcher)
+
+        return matcher
+
+    def snapshot(self):
+        # An immutable copy of the words that is cheap to send to another process
+        version, words = self._snapshot
+        if version != self.version:
+            words = {word: tuple(user_ids) for word, user_ids in self.words.items()}
+            self._snapshot = (self.version, words)
+
+        return words
+
+    def find(self, content, engine="automaton", budget=patterns.BUDGET):
+        return matching.find_highlights(self.matcher(engine), self.words, content, budget)
+
+    def add(self, user_id, word):
+        user_ids = self.words.setdefault(word, set())
+        if user_id in user_ids:
+            return False
+
+        user_ids.add(user_id)
+        self.users.setdefault(user_id, set()).add(word)
+        self.version += 1
+        return True
+
+    def remove(self, user_id, word):
+        user_ids = self.words.get(word)
+        if not user_ids or user_id not in user_ids:
+            return False
+
+        user_ids.discard(user_id)
+        if not user_ids:
+            del self.words[word]
+
+        words = self.users[user_id]
+        words.discard(word)
+        if not words:
+            del self.users[user_id]
+
+        self.version += 1
+        return True
+
+    def clear(self, user_id):
+        words = self.users.pop(user_id, set())
+        for word in words:
+            user_ids = self.words[word]
+            user_ids.discard(user_id)
+            if not user_ids:
+                del self.words[word]
+
+        if words:
+            self.version += 1
+        return words
+
+    def replace(self, pairs):
+        # Used when resyncing with the database, so nothing changes if it already matches
+        words = {}
+        users = {}
+        for user_id, word in pairs:
+            words.setdefault(word, set()).add(user_id)
+            users.setdefault(user_id, set()).add(word)
+
+        if words == self.words:
+            return False
+
+        self.words = words
+        self.users = users
+        self.version += 1
+        return True
+
+class WordIndex:
+    """In-memory index of highlight words keyed by guild, then by word, then by user ID."""
+
+    def __init__(self):
+        self.guilds = {}
+
+    def __len__(self):
+        return sum(len(guild.words) for guild in self.guilds.values())
+
+    def get(self, guild_id):
+        return self.guilds.get(guild_id)
+
+    def add(self, guild_id, user_id, word):
+        guild = self.guilds.get(guild_id)
+        if guild is None:
+            guild = self.guilds[guild_id] = GuildWords(guild_id)
+
+        return guild.add(user_id, word)
+
+    def remove(self, guild_id, user_id, word):
+        guild = self.guilds.get(guild_id)
+        if guild is None:
+            return False
+
+        return guild.remove(user_id, word)
+
+    def clear(self, guild_id, user_id):
+        guild = self.guilds.get(guild_id)
+        if guild is None:
+            return set()
+
+        return guild.clear(user_id)
+
+    def replace(self, guild_id, pairs):
+        guild = self.guilds.get(guild_id)
+        if guild is None:
+            guild = self.guilds[guild_id] = GuildWords(guild_id)
+
+        return guild.replace(pairs)
+
+    def user_words(self, guild_id, user_id):
+        guild = self.guilds.get(guild_id)
+        if guild is None:
+            return []
+
+        return sorted(guild.users.get(user_id, ()))
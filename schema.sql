@@ -27,7 +27,147 @@ message_id BIGINT,
 author_id BIGINT,
 user_id BIGINT,
 word TEXT,
-invoked_at TEXT
-);
+invoked_at TIMESTAMPTZ
+) PARTITION BY RANGE (invoked_at);
 
 CREATE UNIQUE INDEX IF NOT EXISTS unique_words_index ON words (user_id, guild_id, word);
+
+-- invoked_at used to be stored as ISO 8601 text
+DO $$
+BEGIN
+    IF (SELECT data_type FROM information_schema.columns WHERE table_name='highlights' AND column_name='invoked_at') = 'text' THEN
+        ALTER TABLE highlights ALTER COLUMN invoked_at TYPE TIMESTAMPTZ USING invoked_at::timestamptz;
+    END IF;
+END $$;
+
+-- Highlights are partitioned by month (in UTC), so old months can be dropped instead of deleted
+CREATE OR REPLACE FUNCTION create_highlight_partition(month DATE) RETURNS VOID AS $$
+DECLARE
+    start TIMESTAMP := date_trunc('month', month);
+BEGIN
+    EXECUTE format(
+        'CREATE TABLE IF NOT EXISTS %I PARTITION OF highlights FOR VALUES FROM (%L) TO (%L)',
+        'highlights_' || to_char(start, 'YYYY_MM'),
+        start at time zone 'utc',
+        (start + interval '1 month') at time zone 'utc'
+    );
+END;
+$$ LANGUAGE plpgsql;
+
+-- highlights used to be a regular table
+DO $$
+DECLARE
+    month DATE;
+BEGIN
+    IF (SELECT relkind FROM pg_class WHERE oid='highlights'::regclass) = 'r' THEN
+        ALTER TABLE highlights RENAME TO highlights_legacy;
+        CREATE TABLE highlights (LIKE highlights_legacy) PARTITION BY RANGE (invoked_at);
+        CREATE TABLE highlights_default PARTITION OF highlights DEFAULT;
+
+        FOR month IN SELECT DISTINCT date_trunc('month', highlights_legacy.invoked_at at time zone 'utc')::date FROM highlights_legacy WHERE highlights_legacy.invoked_at IS NOT NULL LOOP
+            PERFORM create_highlight_partition(month);
+        END LOOP;
+
+        INSERT INTO highlights SELECT * FROM highlights_legacy;
+        DROP TABLE highlights_legacy;
+    END IF;
+END $$;
+
+-- Catches anything without a partition, like rows without a time
+CREATE TABLE IF NOT EXISTS highlights_default PARTITION OF highlights DEFAULT;
+
+SELECT create_highlight_partition((now() at time zone 'utc')::date);
+SELECT create_highlight_partition(((now() at time zone 'utc') + interval '1 month')::date);
+
+CREATE INDEX IF NOT EXISTS highlights_invoked_at_index ON highlights USING BRIN (invoked_at);
+CREATE INDEX IF NOT EXISTS highlights_user_guild_index ON highlights (user_id, guild_id);
+
+ALTER TABLE settings ADD COLUMN IF NOT EXISTS cooldown INT;
+
+CREATE TABLE IF NOT EXISTS highlight_jobs (
+id BIGSERIAL PRIMARY KEY,
+guild_id BIGINT,
+guild_name TEXT,
+channel_id BIGINT,
+message_id BIGINT,
+author_id BIGINT,
+user_id BIGINT,
+word TEXT,
+span_start INT,
+span_end INT,
+attempts INT DEFAULT 0,
+available_at TIMESTAMP DEFAULT (now() at time zone 'utc'),
+created_at TIMESTAMP DEFAULT (now() at time zone 'utc')
+);
+
+CREATE INDEX IF NOT EXISTS highlight_jobs_available_index ON highlight_jobs (available_at, id);
+
+CREATE TABLE IF NOT EXISTS highlight_counters (
+guild_id BIGINT,
+day DATE,
+count BIGINT DEFAULT 0,
+PRIMARY KEY (guild_id, day)
+);
+
+-- Counted once from the existing highlights, after that they're kept up to date on insert
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM highlight_counters) THEN
+        INSERT INTO highlight_counters (guild_id, day, count)
+        SELECT highlights.guild_id, (highlights.invoked_at at time zone 'utc')::date, COUNT(*)
+        FROM highlights
+        WHERE highlights.guild_id IS NOT NULL AND highlights.invoked_at IS NOT NULL
+        GROUP BY 1, 2;
+    END IF;
+END $$;
+
+-- Covers the history command, which pages through a user's highlights newest first
+CREATE INDEX IF NOT EXISTS highlights_history_index ON highlights (user_id, invoked_at DESC, message_id DESC) INCLUDE (guild_id, channel_id, word);
+
+-- Changes to words and settings are published with pg_notify, so every process can keep its
+-- caches in step. Each guild's word changes (and all settings changes, under scope 0) are
+-- numbered, so a listener can tell when it has missed one.
+CREATE TABLE IF NOT EXISTS cache_versions (
+scope BIGINT PRIMARY KEY,
+version BIGINT DEFAULT 0
+);
+
+CREATE OR REPLACE FUNCTION bump_cache_version(scope_id BIGINT) RETURNS BIGINT AS $$
+    INSERT INTO cache_versions (scope, version)
+    VALUES (scope_id, 1)
+    ON CONFLICT (scope)
+    DO UPDATE SET version=cache_versions.version+1
+    RETURNING version;
+$$ LANGUAGE sql;
+
+CREATE OR REPLACE FUNCTION notify_words_change() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP IN ('DELETE', 'UPDATE') THEN
+        PERFORM pg_notify('highlight_words', json_build_object('op', 'remove', 'version', bump_cache_version(OLD.guild_id), 'guild_id', OLD.guild_id, 'user_id', OLD.user_id, 'word', OLD.word)::text);
+    END IF;
+
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM pg_notify('highlight_words', json_build_object('op', 'add', 'version', bump_cache_version(NEW.guild_id), 'guild_id', NEW.guild_id, 'user_id', NEW.user_id, 'word', NEW.word)::text);
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION notify_settings_change() RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM pg_notify('highlight_settings', json_build_object('version', bump_cache_version(0), 'user_id', COALESCE(NEW.user_id, OLD.user_id))::text);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE pg_trigger.tgname='words_notify') THEN
+        CREATE TRIGGER words_notify AFTER INSERT OR UPDATE OR DELETE ON words FOR EACH ROW EXECUTE FUNCTION notify_words_change();
+    END IF;
+
+    IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE pg_trigger.tgname='settings_notify') THEN
+        CREATE TRIGGER settings_notify AFTER INSERT OR UPDATE OR DELETE ON settings FOR EACH ROW EXECUTE FUNCTION notify_settings_change();
+    END IF;
+END $$;
@@ -0,0 +1,199 @@
+import argparse
+import asyncio
+import logging
+
+import asyncpg
+import discord
+
+from cogs.utils import cache, db, render
+
+log = logging.getLogger("highlight.worker")
+logging.basicConfig(
+    level=logging.INFO,
+    format="(%(asctime)s) %(levelname)s %(message)s",
+    datefmt="%m/%d/%y - %H:%M:%S %Z"
+)
+
+class DeliveryWorker:
+    """Sends the highlights the bot queues in highlight_jobs when delivery_mode is "queue".
+
+    Jobs are claimed with FOR UPDATE SKIP LOCKED by pushing their available_at past a lease, so
+    other workers skip them without a transaction being held open while they're sent. If a
+    worker dies, its jobs become available again once the lease runs out.
+    """
+
+    def __init__(self, config, *, batch=20, poll=1, max_attempts=5, lease=300):
+        self.config = config
+        self.batch = batch
+        self.poll = poll
+        self.max_attempts = max_attempts
+        self.lease = lease
+
+        # Only used over REST, it never connects to the gateway
+        self.client = discord.Client(intents=discord.Intents.none())
+        self.db = None
+        self._channels = cache.LRUCache(1000)
+
+    async def start(self):
+        log.info("Logging in")
+        await self.client.login(self.config.token)
+
+        log.info("Connecting with database")
+        self.db = await asyncpg.create_pool(self.config.database_uri)
+
+    async def close(self):
+        await self.client.close()
+        if self.db:
+            await self.db.close()
+
+    async def run(self, once=False):
+        while True:
+            claimed = await self.process()
+            if not claimed:
+                if once:
+                    return
+                await asyncio.sleep(self.poll)
+
+    async def claim(self):
+        query = """UPDATE highlight_jobs
+                   SET attempts=highlight_jobs.attempts+1, available_at=(now() at time zone 'utc') + interval '1 second' * $2
+                   WHERE highlight_jobs.id IN (
+                       SELECT highlight_jobs.id
+                       FROM highlight_jobs
+                       WHERE highlight_jobs.available_at <= (now() at time zone 'utc')
+                       ORDER BY highlight_jobs.available_at, highlight_jobs.id
+                       LIMIT $1
+                       FOR UPDATE SKIP LOCKED
+                   )
+                   RETURNING *;
+                """
+        return await self.db.fetch(query, self.batch, self.lease)
+
+    async def process(self):
+        jobs = await self.claim()
+        if not jobs:
+            return 0
+
+        done = []
+        retry = []
+        delivered = []
+
+        # Everything for the same user goes out together
+        users = {}
+        for job in jobs:
+            # Claimed too many times without finishing, most likely because it keeps taking the worker down
+            if job["attempts"] > self.max_attempts:
+                log.warning("Dropping job ID %s after %s attempts", job["id"], job["attempts"])
+                done.append(job["id"])
+                continue
+
+            users.setdefault(job["user_id"], []).append(job)
+
+        for user_id, user_jobs in users.items():
+            try:
+                user_delivered, user_done, user_retry = await self.deliver(user_id, user_jobs)
+            except Exception:
+                # One bad job shouldn't take the rest of the claim down with it
+                log.exception("Couldn't deliver to user ID %s, retrying later", user_id)
+                retry.extend(job["id"] for job in user_jobs)
+                continue
+
+            delivered.extend(user_delivered)
+            done.extend(user_done)
+            retry.extend(user_retry)
+
+        async with self.db.acquire() as connection:
+            async with connection.transaction():
+                if delivered:
+                    await db.insert_highlights(connection, [db.highlight_record(message, job["user_id"], job["word"]) for job, message in delivered])
+
+                if done:
+                    await connection.execute("DELETE FROM highlight_jobs WHERE highlight_jobs.id=ANY($1::bigint[]);", done)
+
+                if retry:
+                    query = """DELETE FROM highlight_jobs
+                               WHERE highlight_jobs.id=ANY($1::bigint[]) AND highlight_jobs.attempts >= $2;
+                            """
+                    await connection.execute(query, retry, self.max_attempts)
+
+                    query = """UPDATE highlight_jobs
+                               SET available_at=(now() at time zone 'utc') + interval '1 second' * power(2, highlight_jobs.attempts)
+                               WHERE highlight_jobs.id=ANY($1::bigint[]);
+                            """
+                    await connection.execute(query, retry)
+
+        return len(jobs)
+
+    async def get_channel(self, channel_id):
+        channel = self._channels.get(channel_id)
+        if not channel:
+            channel = await self.client.fetch_channel(channel_id)
+            self._channels[channel_id] = channel
+
+        return channel
+
+    async def deliver(self, user_id, jobs):
+        """Returns the (job, message) pairs that were sent, and the IDs of the jobs that are done and to retry."""
+
+        rendered = []
+        done = []
+
+        for job in jobs:
+            try:
+                channel = await self.get_channel(job["channel_id"])
+                message = await channel.fetch_message(job["message_id"])
+                history = [cache.RecentMessage.from_message(ms) async for ms in channel.history(limit=3, before=message)]
+            except (discord.NotFound, discord.Forbidden):
+                # The message was deleted or we can't see it anymore, so there's nothing to send
+                log.info("Dropping job ID %s, message ID %s is gone", job["id"], job["message_id"])
+                done.append(job["id"])
+                continue
+
+            em = render.HighlightRender(message, history, job["guild_name"]).embed(job["word"], (job["span_start"], job["span_end"]))
+            rendered.append((job, message, em))
+
+        if not rendered:
+            return [], done, []
+
+        dm = await self.client.create_dm(discord.Object(id=user_id))
+        groups = render.split_embeds(rendered, lambda item: item[2])
+        delivered = []
+
+        for index, group in enumerate(groups):
+            try:
+                await dm.send(embeds=[em for job, message, em in group], view=render.JumpBackView(*[message.jump_url for job, message, em in group]))
+            except discord.Forbidden:
+                log.warning("Forbidden to DM user ID %s", user_id)
+                done.extend(job["id"] for group in groups[index:] for job, message, em in group)
+                break
+            except (discord.HTTPException, OSError):
+                log.exception("Couldn't deliver to user ID %s, retrying later", user_id)
+                return delivered, done, [job["id"] for group in groups[index:] for job, message, em in group]
+
+            log.info("Sent %s highlights to user ID %s", len(group), user_id)
+            delivered.extend((job, message) for job, message, em in group)
+            done.extend(job["id"] for job, message, em in group)
+
+        return delivered, done, []
+
+async def main():
+    config = __import__("config")
+
+    parser = argparse.ArgumentParser(description="Deliver queued highlights")
+    parser.add_argument("--batch", type=int, default=getattr(config, "worker_batch", 20), help="jobs to claim at a time")
+    parser.add_argument("--poll", type=float, default=getattr(config, "worker_poll", 1), help="seconds to wait when the queue is empty")
+    parser.add_argument("--max-attempts", type=int, default=getattr(config, "worker_max_attempts", 5), help="times to try a job before dropping it")
+    parser.add_argument("--lease", type=int, default=getattr(config, "worker_lease", 300), help="seconds a claimed job is hidden from other workers")
+    parser.add_argument("--once", action="store_true", help="exit once the queue is empty")
+    args = parser.parse_args()
+
+    worker = DeliveryWorker(config, batch=args.batch, poll=args.poll, max_attempts=args.max_attempts, lease=args.lease)
+    await worker.start()
+
+    try:
+        await worker.run(args.once)
+    finally:
+        await worker.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())